@@ -0,0 +1,64 @@
+#! /usr/bin/env python
+
+import os
+import sys
+from src.core.custom_parser import CustomParser
+from src.surrogates.smokespatialsurrogateloader import SmokeSpatialSurrogateLoader
+
+
+def main():
+    ''' Parse the command line arguments provided,
+        and compile the SMOKE spatial surrogates if the arguments are valid.
+    '''
+    # if the wrong number of arguments are given, show help menu
+    if len(sys.argv) != 3:
+        usage()
+
+    # if help flag is given, show help menu
+    for arg in sys.argv[1:]:
+        if arg.lower() in ['-h', '--h', '-help', '--help']:
+            usage()
+
+    config_file_path, output_path = sys.argv[1:]
+    if not os.path.exists(config_file_path):
+        print('\n\nERROR: Config file not found: %s\n\n' % config_file_path)
+        sys.exit(1)
+
+    compile_surrogates(config_file_path, output_path)
+
+
+def compile_surrogates(config_file_path, output_path):
+    ''' Read the SMOKE v4 spatial surrogates (and labels) from an ESTA config file,
+        and write them, for every region, to a single compiled binary file.
+    '''
+    config = CustomParser(config_file_path)
+    loaders = config.getlist('Surrogates', 'spatial_loaders')
+    if 'SmokeSpatialSurrogateLoader' not in loaders:
+        print('\n\nERROR: Config file does not use the SmokeSpatialSurrogateLoader: %s\n\n' % config_file_path)
+        sys.exit(1)
+
+    loader = SmokeSpatialSurrogateLoader(config, loaders.index('SmokeSpatialSurrogateLoader'))
+    loader.regions = sorted(loader.region_info)
+
+    print('\nCompiling %d SMOKE spatial surrogates to: %s' % (len(loader.smoke_surrogates), output_path))
+    loader.compile(output_path)
+
+
+def usage():
+    ''' In the event that the command line arguments to this script are invalid,
+        print a very brief help menu, describing how to run this script from the command line.
+    '''
+    help_text = '''\n\nCompile SMOKE Spatial Surrogates Usage
+\nProvide the path to a config file that uses the SmokeSpatialSurrogateLoader,
+and the path of the compiled file to create:\n
+\t python compile_surrogates.py config/example_onroad_ca_4km_txt_simple.ini CA_4km_2018.srg
+\nThen use it in a config file:\n
+\tspatial_loaders: CompiledSpatialSurrogateLoader
+\tcompiled_surrogates: CA_4km_2018.srg\n
+'''
+    print(help_text)
+    sys.exit()
+
+
+if __name__ == '__main__':
+    main()
@@ -24,3 +24,7 @@ class EmissionsLoader(object):
     @abc.abstractmethod
     def load(self, emissions):
         return
+
+    def load_date(self, emissions, date):
+        """ Load the emissions for a single (base-year) date, for streaming runs """
+        raise NotImplementedError(self.__class__.__name__ + ' does not support streaming emissions.')
@@ -1,18 +1,29 @@
 
+from datetime import timedelta
+from multiprocessing import Pool
+import sys
+from threading import Thread
 from src.core.output_files import OutputFiles
 from src.core.version import __version__
 import pdb
 
+# the model being run in parallel, inherited by the worker processes when they are forked
+_MODEL = None
+
 
 class EstaModel(object):
 
-    def __init__(self, spatial_loaders, temporal_loaders, emis_loaders, emis_scalars, writers, tests):
+    def __init__(self, spatial_loaders, temporal_loaders, emis_loaders, emis_scalars, writers, tests,
+                 date_processes=1, streaming=False, prefetch=False):
         self.spatial_loaders = spatial_loaders
         self.temporal_loaders = temporal_loaders
         self.emis_loaders = emis_loaders
         self.emis_scalars = emis_scalars
         self.writers = writers
         self.testers = tests
+        self.date_processes = date_processes
+        self.streaming = streaming
+        self.prefetch = prefetch
         self.spat_surrs = None
         self.temp_surrs = None
         self.emissions = None
@@ -35,19 +46,161 @@ class EstaModel(object):
         for temporal_loader in self.temporal_loaders:
             self.temp_surrs = temporal_loader.load(self.spat_surrs, self.temp_surrs)
 
-        print('  - loading emissions data')
-        for emis_loader in self.emis_loaders:
-            self.emissions = emis_loader.load(self.emissions)
+        if self.streaming:
+            print('  - streaming emissions data, scaling emissions & writing files')
+            output_files = self._scale_streaming()
+        else:
+            print('  - loading emissions data')
+            for emis_loader in self.emis_loaders:
+                self.emissions = emis_loader.load(self.emissions)
+
+            print('  - scaling emissions & writing files')
+            if self.date_processes > 1:
+                output_files = self._scale_parallel()
+            else:
+                output_files = self._scale_and_write()
 
-        print('  - scaling emissions & writing files')
+        if self.testers:
+            print('  - testing output files')
+        for tester in self.testers:
+            tester.test(self.emissions, output_files)
+
+    def _scale_and_write(self, date_block=None):
+        ''' Scale the emissions and write the output files, for either the entire modeling
+            period or a single (start, end) block of base-year dates.
+        '''
         output_files = OutputFiles()
         for scalar in self.emis_scalars:
+            if date_block:
+                scalar.base_start_date, scalar.base_end_date = date_block
             for scaled_emissions in scalar.scale(self.emissions, self.spat_surrs, self.temp_surrs):
                 for writer in self.writers:
                     output_files.union(writer.write(scaled_emissions))
 
-        if self.testers:
-            print('  - testing output files')
-        for tester in self.testers:
-            tester.test(self.emissions, output_files)
+        return output_files
+
+    def _scale_parallel(self):
+        ''' Send each date in the modeling period to a pool of worker processes.
+            Each worker runs the scalers and writers for its dates, and the output files
+            are merged back together in date order.
+            NOTE: The workers inherit the loaded surrogates and emissions when they are forked,
+                  so nothing large has to be pickled.
+        '''
+        global _MODEL
+        _MODEL = self
+
+        blocks = self._date_blocks()
+        pool = Pool(min(self.date_processes, len(blocks)))
+
+        output_files = OutputFiles()
+        try:
+            for files in pool.imap(_scale_date_block, blocks):
+                new_files = OutputFiles()
+                for date, file_paths in files.iteritems():
+                    new_files[date] = file_paths
+                output_files.union(new_files)
+        finally:
+            pool.close()
+            pool.join()
+            _MODEL = None
+
+        return output_files
+
+    def _scale_streaming(self):
+        ''' Load the emissions for one date at a time, and scale and write that date before
+            loading the next. The next date can optionally be loaded on a background thread.
+            Only the emissions for the testing dates are kept, for the testers.
+        '''
+        test_dates = set(d[5:] for tester in self.testers for d in tester.dates)
+        tested = None
+
+        output_files = OutputFiles()
+        for date_block, emissions in self._stream_emissions(self._date_blocks()):
+            self.emissions = emissions
+            output_files.union(self._scale_and_write(date_block))
+
+            # keep the emissions for testing
+            date = date_block[0].strftime(self.emis_scalars[0].date_format)
+            if date[5:] in test_dates and emissions:
+                if tested is None:
+                    tested = emissions
+                else:
+                    for region, tables in emissions.data.iteritems():
+                        tested.data.setdefault(region, {}).update(tables)
+
+        self.emissions = tested
+        return output_files
+
+    def _stream_emissions(self, date_blocks):
+        ''' Generator: load the emissions for each (single-day) date block, in order.
+            If prefetching, the next date is loaded on a background thread while the current
+            date is being scaled and written.
+        '''
+        next_load = None
+        for i, date_block in enumerate(date_blocks):
+            if next_load:
+                emissions = next_load.result()
+            else:
+                emissions = self._load_date(date_block[0])
+
+            if self.prefetch and i + 1 < len(date_blocks):
+                next_load = _Prefetch(self._load_date, date_blocks[i + 1][0])
+                next_load.start()
+
+            yield date_block, emissions
+
+    def _load_date(self, date):
+        ''' load the emissions for a single base-year date, from every emissions loader '''
+        emissions = None
+        for emis_loader in self.emis_loaders:
+            emissions = emis_loader.load_date(emissions, date)
+
+        return emissions
+
+    def _date_blocks(self):
+        ''' split the base-year modeling period into single-day (start, end) blocks '''
+        scalar = self.emis_scalars[0]
+        today = scalar.base_start_date
+
+        blocks = []
+        while today <= scalar.base_end_date:
+            blocks.append((today, today))
+            today += timedelta(days=1)
+
+        return blocks
+
+
+def _scale_date_block(date_block):
+    ''' Worker process: scale and write a single block of dates.
+        The OutputFiles are returned as a plain dictionary, so they can be pickled.
+    '''
+    try:
+        return dict(_MODEL._scale_and_write(date_block))
+    except SystemExit as e:
+        # a sys.exit() would kill the worker and hang the pool
+        raise RuntimeError(str(e))
+
+
+class _Prefetch(Thread):
+    ''' A background thread to call a single function, holding onto the result (or error) '''
+
+    def __init__(self, func, *args):
+        Thread.__init__(self)
+        self.daemon = True
+        self.func = func
+        self.args = args
+        self._result = None
+        self._error = None
+
+    def run(self):
+        try:
+            self._result = self.func(*self.args)
+        except BaseException:
+            self._error = sys.exc_info()
 
+    def result(self):
+        ''' wait for the thread to finish, and return the result, re-raising any error '''
+        self.join()
+        if self._error:
+            raise self._error[0], self._error[1], self._error[2]
+        return self._result
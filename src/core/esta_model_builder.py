@@ -19,8 +19,18 @@ class EstaModelBuilder(object):
         scalers = self._init_classes('Scaling', 'scalar')
         writers = self._init_classes('Output', 'writers')
         testers = self._init_classes('Testing', 'tests')
-
-        return EstaModel(spatial_loaders, temporal_loaders, emis_loaders, scalers, writers, testers)
+        date_processes = int(self.config['Scaling'].get('date_processes', 1))
+        streaming = self._getboolean('Emissions', 'streaming')
+        prefetch = self._getboolean('Emissions', 'prefetch')
+
+        return EstaModel(spatial_loaders, temporal_loaders, emis_loaders, scalers, writers, testers,
+                         date_processes, streaming, prefetch)
+
+    def _getboolean(self, section, option):
+        ''' read an optional True/False config value, which defaults to False '''
+        if option not in self.config[section]:
+            return False
+        return self.config.getboolean(section, option)
 
     def _init_classes(self, section, option):
         ''' Given a list of class names, instantiate a list of primary step
@@ -3,9 +3,12 @@ from collections import defaultdict
 from copy import deepcopy
 from datetime import datetime, timedelta
 import gzip
+from hashlib import sha1
+from multiprocessing.pool import ThreadPool
 import numpy as np
 import os
 import sys
+from weakref import ref
 from src.core.emissions_loader import EmissionsLoader
 from emissions_table import EmissionsTable
 
@@ -28,6 +31,11 @@ class Emfac2014CsvLoader(EmissionsLoader):
         self.region_names = dict((g, d['name']) for g,d in self.region_info.iteritems())
         self.vtp2eic = self.config.eval_file('Emissions', 'vtp2eic')
         self.hd_ld = 'ld'
+        self._cache_period = None  # the season or month of the cached emissions files
+        self._cache = {}
+        self.cache_directory = self.config['Emissions'].get('cache_directory', '')
+        self._settings_hash = None
+        self.read_threads = int(self.config['Emissions'].get('read_threads', 1))
         self.config['Output']['dpmout'] = False
         try:
             self.dpm_polls = self.config.getlist('Output', 'dpm')
@@ -49,102 +57,235 @@ class Emfac2014CsvLoader(EmissionsLoader):
         if not emissions:
             emissions = EMFAC2014EmissionsData()
 
+        # load emissions for each date in the period
+        dates = []
+        today = deepcopy(self.base_start_date)
+        while today <= self.base_end_date:
+            dates.append(today)
+            today += timedelta(days=1)
+
+        # read all the daily files at once, if we have a pool of threads to read them with
+        if self.time_units == 'daily' and self.read_threads > 1:
+            return self._load_daily_files(emissions, dates)
+
+        for today in dates:
+            emissions = self.load_date(emissions, today)
+
+        return emissions
+
+    def load_date(self, emissions, today):
+        """ Load the emissions for a single (base-year) date, so that a long run can be
+            streamed one day at a time.
+            The first step is to determine the time-scale of the emissions.
+        """
+        # initialize emissions, if needed
+        if not emissions:
+            emissions = EMFAC2014EmissionsData()
+
         # load emissions for the correct time scale
         if self.time_units == 'daily':
-            return self.load_daily(emissions)
+            return self.load_daily(emissions, today)
         elif self.time_units == 'daily_hd':
-            return self.load_daily_hd(emissions)
+            return self.load_daily_hd(emissions, today)
         elif self.time_units == 'seasonally':
-            return self.load_seasonally(emissions)
+            return self.load_seasonally(emissions, today)
         elif self.time_units == 'monthly':
-            return self.load_monthly(emissions)
+            return self.load_monthly(emissions, today)
         else:
             raise ValueError('EMFAC2014 emissions must be: daily, seasonally, or monthly.')
 
-    def load_daily(self, emissions):
+    def load_daily(self, emissions, today):
         """ Read the daily EMFAC2014 CSV file and load them into the master emissions dictionary.
             This method is independent of LD/HD CSV file type.
         """
+        return self._load_daily_files(emissions, [today])
+
+    def _load_daily_files(self, emissions, dates):
+        """ Read the daily EMFAC2014 CSV files for every region and date, and load them into the
+            master emissions dictionary. The files may be read concurrently, but they are always
+            loaded in (date, region) order.
+        """
         file_paths = os.path.join(self.directory, '%02d', '%02d', '%s.csv')
-        today = deepcopy(self.base_start_date)
-        while today <= self.base_end_date:
+        files = []
+        for today in dates:
             for region in self.regions:
                 #region_name = self.region_names[int(region)].split(' (')[0].replace(' ', '_')
                 region_info = self.region_info[int(region)]
                 region_name = '_'.join([region_info['county_name'], region_info['air_basin'], region_info['district']]).replace(' ','_')
                 file_name = '_'.join([region_name, 'emission'])
                 file_path = file_paths % (today.month, today.day, file_name)
-                emissions.set(region, today.strftime(self.date_format),
-                              self.read_emfac_file(file_path, region))
-            today += timedelta(days=1)
+                files.append((today.strftime(self.date_format), region, file_path))
+
+        tables = self._read_emfac_files([(file_path, region) for _, region, file_path in files])
+        for (date, region, _), table in zip(files, tables):
+            emissions.set(region, date, table)
 
         return emissions
 
-    def load_daily_hd(self, emissions):
+    def load_daily_hd(self, emissions, today):
         file_paths = os.path.join(self.directory, '%02d', '%02d', 'emfac_hd.csv_all')
-        today = deepcopy(self.base_start_date)
-        while today <= self.base_end_date:
-            file_path = file_paths % (today.month, today.day)
+        file_path = file_paths % (today.month, today.day)
 
-            emissions_by_region = self.read_emfac_file(file_path)
-            for region in emissions_by_region:
-                emissions.set(region, today.strftime(self.date_format),
-                              emissions_by_region[region])
-            today += timedelta(days=1)
+        emissions_by_region = self._read_emfac_file(file_path)
+        for region in emissions_by_region:
+            emissions.set(region, today.strftime(self.date_format),
+                          emissions_by_region[region])
 
         return emissions
 
-    def load_seasonally(self, emissions):
+    def load_seasonally(self, emissions, today):
         """ Read the seasonal EMFAC2014 CSV file and load them into the master emissions dictionary.
             This method is independent of LD/HD CSV file type.
         """
         file_paths = os.path.join(self.directory, self.hd_ld + '_%s',
                                   'emfac_' + self.hd_ld + '_%s.csv_all')
-        print 'file_paths seasonally', file_paths
-        days_by_season = self.find_days_by_season()
-        for season, dates in days_by_season.iteritems():
-            file_path = file_paths % (season, season)
-            emissions_by_region = self.read_emfac_file(file_path)
-            for date in dates:
-                for region in emissions_by_region:
-                    emissions.set(region, date.strftime(self.date_format),
-                                  emissions_by_region[region])
+        season = 'summer' if today.month in Emfac2014CsvLoader.SUMMER_MONTHS else 'winter'
+        file_path = file_paths % (season, season)
+        emissions_by_region = self._read_period_file(season, file_path)
+        for region in emissions_by_region:
+            emissions.set(region, today.strftime(self.date_format),
+                          emissions_by_region[region])
 
         return emissions
 
-    def find_days_by_season(self):
-        """ A simple helper method to find all the days of interest in each season """
-        days_by_season = defaultdict(list)
-
-        today = deepcopy(self.base_start_date)
-        while today <= self.base_end_date:
-            season = 'summer' if today.month in Emfac2014CsvLoader.SUMMER_MONTHS else 'winter'
-            days_by_season[season].append(deepcopy(today))
-            today += timedelta(days=1)
-
-        return days_by_season
-
-    def load_monthly(self, emissions):
+    def load_monthly(self, emissions, today):
         """ Read the monthly EMFAC2014 CSV file and load them into the master emissions dictionary.
             This method is independent of LD/HD CSV file type.
         """
         file_paths = os.path.join(self.directory, '%02d', 'emis', '%s.csv')
 
         for region in self.regions:
-            today = deepcopy(self.base_start_date)
-            month = -1
-            while today <= self.base_end_date:
-                month = today.month
-                file_path = file_paths % (month, region)
-                emis = self.read_emfac_file(file_path, region)
-                month_new = month
-                while month_new == month:
-                    emissions.set(region, today.strftime(self.date_format), emis)
-                    today += timedelta(days=1)
-                    month_new = today.month
+            file_path = file_paths % (today.month, region)
+            emis = self._read_period_file(today.month, file_path, region)
+            emissions.set(region, today.strftime(self.date_format), emis)
 
         return emissions
 
+    def _read_period_file(self, period, file_path, region=0):
+        """ Read an EMFAC2014 file that covers an entire season or month, keeping the results
+            until the period changes. This way, every date in the period shares the same tables.
+        """
+        if self._cache_period != period:
+            self._cache_period = period
+            self._cache = {}
+
+        if file_path not in self._cache:
+            self._cache[file_path] = self._read_emfac_file(file_path, region)
+
+        return self._cache[file_path]
+
+    def _read_emfac_files(self, files):
+        """ Read a list of (file path, region) EMFAC files, returning the results in the same order.
+            With more than one read thread, the files are read on a pool of threads, so the
+            file I/O and gzip decompression of many files can overlap.
+        """
+        if self.read_threads < 2 or len(files) < 2:
+            return [self._read_emfac_file(file_path, region) for file_path, region in files]
+
+        pool = ThreadPool(min(self.read_threads, len(files)))
+        try:
+            results = pool.map(self._read_emfac_thread, files, 1)
+        finally:
+            pool.close()
+            pool.join()
+
+        # re-raise any sys.exit() from the readers, here in the main thread
+        for _, error in results:
+            if error:
+                raise error
+
+        return [emis for emis, _ in results]
+
+    def _read_emfac_thread(self, file_info):
+        """ Read one EMFAC file on a pool thread, returning the result and any sys.exit() """
+        try:
+            return self._read_emfac_file(*file_info), None
+        except SystemExit as e:
+            return None, e
+
+    def _read_emfac_file(self, file_path, region=0):
+        """ Read an EMFAC file, using the on-disk cache of parsed emissions tables, if the user
+            has provided a cache directory.
+            The cache key covers the input file's size and modification time, and all the settings
+            that change how the file is parsed.
+        """
+        if not self.cache_directory:
+            return self.read_emfac_file(file_path, region)
+
+        key = self._cache_key(file_path, region)
+        if key is None:
+            # the file doesn't exist, let the reader handle that
+            return self.read_emfac_file(file_path, region)
+
+        cache_path = os.path.join(self.cache_directory, key + '.npz')
+        if os.path.exists(cache_path):
+            return self._load_cache_file(cache_path)
+
+        emis = self.read_emfac_file(file_path, region)
+        self._write_cache_file(cache_path, emis)
+        return emis
+
+    def _cache_key(self, file_path, region):
+        """ build a unique key for the parsed version of an EMFAC file """
+        stats = []
+        for path in (file_path, file_path + '.gz'):
+            if os.path.exists(path):
+                st = os.stat(path)
+                stats.append((os.path.abspath(path), st.st_size, st.st_mtime))
+        if not stats:
+            return None
+
+        # hash the settings that change how a file is parsed
+        if self._settings_hash is None:
+            factors = sorted((eic, info[2], info[3] if len(info) > 3 else None)
+                             for eic, info in self.eic_info.iteritems())
+            settings = (sorted(self.vtp2eic.iteritems()), factors, self.config['Output']['dpmout'],
+                        sorted(getattr(self, 'dpm_polls', [])), sorted(self.VALID_POLLUTANTS))
+            self._settings_hash = sha1(repr(settings)).hexdigest()
+
+        key = (self.__class__.__name__, stats, region, self._settings_hash)
+        return sha1(repr(key)).hexdigest()
+
+    @staticmethod
+    def _load_cache_file(cache_path):
+        """ Load a cached EmissionsTable, or a dictionary of them by region, from a NumPy file """
+        data = np.load(cache_path)
+        tables = {}
+        for i, region in enumerate(data['regions'].tolist()):
+            tables[region] = EmissionsTable(data['eics_%d' % i], data['polls_%d' % i].tolist(),
+                                            data['values_%d' % i])
+        by_region = bool(data['by_region'])
+        data.close()
+
+        if by_region:
+            return tables
+        return tables[0]
+
+    def _write_cache_file(self, cache_path, emis):
+        """ Write an EmissionsTable, or a dictionary of them by region, to a NumPy file """
+        if not os.path.exists(self.cache_directory):
+            try:
+                os.makedirs(self.cache_directory)
+            except OSError:
+                # another read thread may have just created it
+                if not os.path.isdir(self.cache_directory):
+                    raise
+
+        by_region = type(emis) != EmissionsTable
+        tables = emis if by_region else {0: emis}
+        arrays = {'by_region': np.array(by_region), 'regions': np.array(sorted(tables), dtype=np.int64)}
+        for i, region in enumerate(sorted(tables)):
+            arrays['eics_%d' % i] = tables[region].eics
+            arrays['polls_%d' % i] = np.array(tables[region].pollutants, dtype=str)
+            arrays['values_%d' % i] = tables[region].values
+
+        # write to a temporary file first, so a crash never leaves a partial cache file
+        tmp_path = cache_path + '.tmp'
+        f = open(tmp_path, 'wb')
+        np.savez(f, **arrays)
+        f.close()
+        os.rename(tmp_path, cache_path)
+
     def read_emfac_file(self, file_path, region=0):
         """ Read an EMFAC2014 LDV CSV emissions file and colate the data into a table.
             File Format:
@@ -166,82 +307,97 @@ class Emfac2014CsvLoader(EmissionsLoader):
 
         region_name = self.region_names[region]
 
-        # now that file exists, read it
-        header = f.readline()
-        for line in f.readlines():
-            ln = line.strip().split(',')
-            # ln[0] --> calendar_year
-            # ln[1] --> season_month
-            # ln[2] --> sub_area
-            # ln[3] --> vehicle_class
-            # ln[4] --> fuel
-            # ln[5] --> process
-            # ln[6] --> cat_ncat
-            # ln[7] --> pollutant
-            # ln[8] --> emissions
-            poll = ln[7].upper()
-            if poll == 'PM2_5':
-                poll = 'PM25'
-
-            if poll not in Emfac2014CsvLoader.VALID_POLLUTANTS:
-                continue
-            if ln[2] != region_name:
-                try:
-                    self.REGION_CORRECTION[ln[2]]
-                except:
-                    continue
-            v = ln[3]
-            fuel_type = ln[4]
-            t = ln[6]
-            if v == 'SBUS' and t == 'DSL':
-                # There is no such thing as Light-Duty, Diesel School Busses.
-                continue
-            p = ln[5]
-
-            if fuel_type == 'Elec':
-                t = fuel_type
-
-            eic = self.vtp2eic[(v, t, p)]
+        # now that file exists, tokenize the whole thing at once (skipping the header)
+        lines = f.read().splitlines()[1:]
+        f.close()
+        cols = np.array([line.strip().split(',') for line in lines if line.strip()])
+        if not len(cols):
+            return e
+
+        sub_area = cols[:, 2]
+        return self._build_ld_table(cols, (sub_area == region_name) | np.in1d(sub_area, self.REGION_CORRECTION.keys()))
+
+    def _build_ld_table(self, cols, rows):
+        """ Build an EmissionsTable from the tokenized lines of an EMFAC2014 LDV CSV file,
+            using only the lines in the given boolean mask of rows.
+        """
+        e = EmissionsTable()
+
+        # ln[2] --> sub_area, ln[3] --> vehicle_class, ln[4] --> fuel, ln[5] --> process,
+        # ln[6] --> cat_ncat, ln[7] --> pollutant, ln[-1] --> emissions
+        v = cols[:, 3]
+        fuel_type = cols[:, 4]
+        p = cols[:, 5]
+        t = cols[:, 6]
+        poll = np.char.upper(cols[:, 7])
+        poll[poll == 'PM2_5'] = 'PM25'
+
+        # filter out irrelevant pollutants, regions, and Light-Duty, Diesel School Busses
+        keep = np.in1d(poll, Emfac2014CsvLoader.VALID_POLLUTANTS)
+        keep &= rows
+        keep &= ~((v == 'SBUS') & (t == 'DSL'))
+        if not keep.any():
+            return e
+
+        t = np.where(fuel_type == 'Elec', fuel_type, t)
+        vals = cols[keep, -1].astype(np.float64).astype(np.float32)
+        poll = poll[keep]
+
+        # map each unique (vehicle, tech, process) to an EIC
+        vtp_strs = np.char.add(np.char.add(v[keep], '\t'), t[keep])
+        vtp_strs = np.char.add(np.char.add(vtp_strs, '\t'), p[keep])
+        vtp_codes, vtps = factorize(vtp_strs)
+        eics = np.zeros(len(vtps), dtype=np.int64)
+        fractions = np.zeros(len(vtps), dtype=np.float32)
+        for i, vtp in enumerate(vtps):
+            eic = self.vtp2eic[tuple(vtp.split('\t'))]
             if eic not in self.eic_info:
                 raise KeyError('eic_info file does not include the EIC: ' + str(eic))
-            value = np.float32(ln[-1]) * np.float32(self.eic_info[eic][2])
-            if value > 0.0:
-                # output DPM scenario
-                if self.config['Output']['dpmout']:
-                    # check if eic_info.py has appended element for "is DPM eic?" (True/False)
-                    try:
-                        is_dpm_eic = self.eic_info[eic][3]
-                    except:
-                        sys.exit('\nERROR: "Run output DPM scenario?" is true, but eic_info file does not include "Is DPM eic?" field.\nCheck file: %s' % self.config['Surrogates']['eic_info'])
-                    # map PM/PM10/PM2.5 to DPM/DPM10/DPM2.5 and aggregate emissions
-                    if is_dpm_eic:
-                        try:
-                            dpmpoll = self.PM2DPM[poll]  # this can fail with non-DPM pollutants -> aggregate to criteria pollutant as normally done
-                            # if DPM/DPM10/DPM2.5 has been identified in config file to output to ncf
-                            if dpmpoll in self.dpm_polls:
-                                e[eic][dpmpoll] += value
-
-                            if poll == 'PM':  # Add DPM to PM
-                                e[eic][poll] += value
-
-                            elif poll == 'PM10':
-                                e[eic][poll] += value
-
-                            elif poll == 'PM25':
-                                e[eic][poll] += value
-
-                        # failed to map PM/PM10/PM2.5 to DPM/DPM10/DPM2.5 (pollutant is likely CO, TOG, NOX, SOX, etc.) --> aggregate to criteria pollutant as normally done
-                        except:
-                            e[eic][poll] += value
-                    # not a DPM eic, therefore aggregate criteria pollutant as normally done 
-                    else:
-                        e[eic][poll] += value
-                # regular scenario (should only involve criteria pollutants)
-                else:
-                    e[eic][poll] += value
+            eics[i] = eic
+            fractions[i] = np.float32(self.eic_info[eic][2])
+
+        values = vals * fractions[vtp_codes]
+        positive = values > 0.0
+        vtp_codes = vtp_codes[positive]
+        values = values[positive]
+        poll = poll[positive]
+
+        # output DPM scenario: map PM/PM10/PM2.5 to DPM/DPM10/DPM2.5 and aggregate emissions
+        if self.config['Output']['dpmout'] and len(values):
+            is_dpm_eic = np.zeros(len(vtps), dtype=bool)
+            for i in np.unique(vtp_codes):
+                # check if eic_info.py has appended element for "is DPM eic?" (True/False)
+                try:
+                    is_dpm_eic[i] = bool(self.eic_info[eics[i]][3])
+                except:
+                    sys.exit('\nERROR: "Run output DPM scenario?" is true, but eic_info file does not include "Is DPM eic?" field.\nCheck file: %s' % self.config['Surrogates']['eic_info'])
 
-        f.close()
-        return e
+            # if DPM/DPM10/DPM2.5 has been identified in config file to output to ncf
+            pms = [pm for pm, dpm in self.PM2DPM.iteritems() if dpm in self.dpm_polls]
+            dpm = is_dpm_eic[vtp_codes] & np.in1d(poll, pms)
+            vtp_codes = np.concatenate((vtp_codes, vtp_codes[dpm]))
+            values = np.concatenate((values, values[dpm]))
+            poll = np.concatenate((poll, [self.PM2DPM[pm] for pm in poll[dpm]]))
+
+        # aggregate by EIC and pollutant, in file order
+        eic_codes, eic_index = factorize(eics[vtp_codes])
+        poll_codes, polls = factorize(poll)
+        table = np.zeros((len(eic_index), len(polls)), dtype=np.float32)
+        np.add.at(table, (eic_codes, poll_codes), values)
+
+        return EmissionsTable(eic_index, polls, table)
+
+
+def factorize(values):
+    """ Encode an array as integer codes, with the unique values in order of first appearance.
+        Output: (codes, uniques)
+    """
+    uniques, first, codes = np.unique(values, return_index=True, return_inverse=True)
+    order = np.argsort(first)
+    ranks = np.empty(len(order), dtype=np.int64)
+    ranks[order] = np.arange(len(order))
+
+    return ranks[codes], uniques[order]
 
 
 class EMFAC2014EmissionsData(object):
@@ -250,10 +406,13 @@ class EMFAC2014EmissionsData(object):
         It is just a multiply-embedded dictionary with keys for things that we find in each file:
         region, date, and Emissions Data Tables.
         The date here should use the base year.
+        The tables are frozen when they are set, so many dates can share the same table.
+        Merging two tables creates a new table, and each merge is only done once.
     """
 
     def __init__(self):
         self.data = {}
+        self._merged = {}
 
     def get(self, region, date):
         """ Getter method for EMFAC2014 Emissions Data dictionary """
@@ -270,10 +429,29 @@ class EMFAC2014EmissionsData(object):
             self.data[region] = {}
 
         # add emissions
+        table.freeze()
         if date not in self.data[region]:
             self.data[region][date] = table
         else:
-            self.data[region][date].add_table(table)
+            self.data[region][date] = self._merge(self.data[region][date], table)
+
+    def _merge(self, old_table, new_table):
+        """ Merge two tables into a new (frozen) table, re-using the result if this same pair
+            of tables has already been merged for another date.
+        """
+        key = (id(old_table), id(new_table))
+        if key in self._merged:
+            # weak references, so the cache never keeps an out-dated table alive
+            old_ref, new_ref, merged_ref = self._merged[key]
+            merged = merged_ref()
+            if old_ref() is old_table and new_ref() is new_table and merged is not None:
+                return merged
+
+        merged = old_table.merge(new_table)
+        merged.freeze()
+        self._merged[key] = (ref(old_table), ref(new_table), ref(merged))
+
+        return merged
 
     def __repr__(self):
         """ standard Python helper to allow for str(x) and print(x) """
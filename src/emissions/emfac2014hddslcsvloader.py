@@ -14,6 +14,9 @@ class Emfac2014HdDslCsvLoader(Emfac2014CsvLoader):
         self.hd_ld = 'hd'
         self.reverse_region_names = dict(zip(self.region_names.values(), self.region_names.keys()))
         self.vtp2eic_lower = dict(((k[0].lower(),k[1].lower(),k[2].lower()),v) for k,v in self.vtp2eic.iteritems())
+        self.region_index = False
+        if 'region_index' in self.config['Emissions']:
+            self.region_index = self.config.getboolean('Emissions', 'region_index')
 
     def read_emfac_file(self, file_path, region=0):
         """ Read an EMFAC2014 HD Diesel CSV emissions file and colate the data into a table
@@ -24,17 +27,22 @@ class Emfac2014HdDslCsvLoader(Emfac2014CsvLoader):
         emis_by_region = {}
 
         # check that the file exists
-        if os.path.exists(file_path):
+        if os.path.exists(file_path) and self.region_index:
+            lines = self._read_indexed_lines(file_path)
+        elif os.path.exists(file_path):
             f = open(file_path, 'r')
+            lines = f.readlines()
+            f.close()
         elif os.path.exists(file_path + '.gz'):
             f = gzip.open(file_path + '.gz', 'rb')
+            lines = f.readlines()
+            f.close()
         else:
             print('    + Emissions File Not Found: ' + file_path)
             return emis_by_region
 
         # now that file exists, read it
-        f = open(file_path, 'r')
-        for line in f.readlines():
+        for line in lines:
             ln = line.rstrip().split(',')
             # is pollutant relevant
             poll = ln[-1].upper()
@@ -51,14 +59,8 @@ class Emfac2014HdDslCsvLoader(Emfac2014CsvLoader):
             if not value:
                 continue
             # pull region info
-            region_name = ln[1]
-            if region_name in self.REGION_CORRECTION:
-                region_name = self.REGION_CORRECTION[region_name]
-            try:
-                region = self.reverse_region_names[region_name]
-            except KeyError:
-                region = int(region_name)
-            
+            region = self._region_number(ln[1])
+
             # fill output dictionary
             if region not in emis_by_region:
                 emis_by_region[region] = EmissionsTable()
@@ -97,5 +99,100 @@ class Emfac2014HdDslCsvLoader(Emfac2014CsvLoader):
             else:
                 emis_by_region[region][eic][poll] += value
 
-        f.close()
         return emis_by_region
+
+    def _region_number(self, region_name):
+        """ convert an EMFAC sub-area name to a region number """
+        if region_name in self.REGION_CORRECTION:
+            region_name = self.REGION_CORRECTION[region_name]
+        try:
+            return self.reverse_region_names[region_name]
+        except KeyError:
+            return int(region_name)
+
+    def _read_indexed_lines(self, file_path):
+        """ Read only the lines of a statewide EMFAC file that belong to the modeled regions,
+            seeking straight to each sub-area with the file's region index.
+        """
+        ranges = []
+        for sub_area, byte_ranges in self._load_region_index(file_path).iteritems():
+            if self._region_number(sub_area) in self.regions:
+                ranges += byte_ranges
+
+        lines = []
+        f = open(file_path, 'rb')
+        for start, end in sorted(ranges):
+            f.seek(start)
+            lines += f.read(end - start).splitlines()
+        f.close()
+
+        return lines
+
+    def _load_region_index(self, file_path):
+        """ Load the region index for an EMFAC file, from the sidecar file next to it.
+            If the sidecar is missing, or was built for an older version of the EMFAC file,
+            the index is rebuilt (and saved, if possible).
+            Sidecar Format:
+            <file size> <file modification time>
+            Modoc (NEP)\t0:1563,2100345:2101908
+        """
+        index_path = file_path + '.idx'
+        st = os.stat(file_path)
+        stamp = '%d %r' % (st.st_size, st.st_mtime)
+
+        if os.path.exists(index_path):
+            f = open(index_path, 'r')
+            lines = f.read().splitlines()
+            f.close()
+            if lines and lines[0] == stamp:
+                index = {}
+                for line in lines[1:]:
+                    sub_area, byte_ranges = line.split('\t')
+                    index[sub_area] = [tuple(int(b) for b in r.split(':')) for r in byte_ranges.split(',')]
+                return index
+
+        index = self.build_region_index(file_path)
+        try:
+            f = open(index_path + '.tmp', 'w')
+            f.write(stamp + '\n')
+            for sub_area in sorted(index):
+                f.write(sub_area + '\t' + ','.join('%d:%d' % r for r in index[sub_area]) + '\n')
+            f.close()
+            os.rename(index_path + '.tmp', index_path)
+        except (IOError, OSError):
+            print('    + Unable to write region index: ' + index_path)
+
+        return index
+
+    @staticmethod
+    def build_region_index(file_path):
+        """ Scan an EMFAC CSV file once, recording the (start, end) byte ranges of each
+            contiguous block of lines for every sub-area.
+        """
+        index = {}
+        last = None
+        start = 0
+        offset = 0
+
+        f = open(file_path, 'rb')
+        for line in f:
+            cols = line.split(',', 2)
+            sub_area = cols[1] if len(cols) > 2 else None
+            if sub_area != last:
+                if last is not None:
+                    index.setdefault(last, []).append((start, offset))
+                last = sub_area
+                start = offset
+            offset += len(line)
+        f.close()
+
+        if last is not None:
+            index.setdefault(last, []).append((start, offset))
+
+        return index
+
+    def _cache_key(self, file_path, region):
+        """ an indexed read only covers the modeled regions, so they are part of the cache key """
+        if self.region_index:
+            region = (region, tuple(sorted(self.regions)))
+        return super(Emfac2014HdDslCsvLoader, self)._cache_key(file_path, region)
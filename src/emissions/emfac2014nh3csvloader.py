@@ -0,0 +1,88 @@
+import gzip
+import numpy as np
+import os
+from emfac2014csvloader import EMFAC2014EmissionsData
+from emfac2014hddslcsvloader import Emfac2014HdDslCsvLoader
+
+
+class Emfac2014Nh3CsvLoader(Emfac2014HdDslCsvLoader):
+    """ Load the supplemental EMFAC NH3 emissions. These come in one statewide file per year,
+        for each of the LD and HD vehicle types:
+            nh3_ld_YYYY.csv
+            nh3_hd_YYYY.csv
+        Each file is read only once, and the same NH3 emissions are added to every date in the run.
+        NOTE: Do not use this loader with EMFAC files that already have the NH3 appended to them.
+    """
+
+    def __init__(self, config, position):
+        super(Emfac2014Nh3CsvLoader, self).__init__(config, position)
+        self.nh3 = None
+
+    def load_date(self, emissions, today):
+        """ Add the (annual) NH3 emissions to a single (base-year) date """
+        # initialize emissions, if needed
+        if not emissions:
+            emissions = EMFAC2014EmissionsData()
+
+        if self.time_units != 'annual':
+            raise ValueError('EMFAC NH3 emissions must be: annual.')
+
+        if self.nh3 is None:
+            self.nh3 = self.read_nh3_files()
+
+        for region in sorted(self.nh3):
+            emissions.set(region, today.strftime(self.date_format), self.nh3[region])
+
+        return emissions
+
+    def read_nh3_files(self):
+        """ Read the LD and HD NH3 files for the base year, and colate the data into
+            one table per region.
+        """
+        file_path = os.path.join(self.directory, 'nh3_%s_' + str(self.base_year) + '.csv')
+        ld_path = file_path % 'ld'
+        hd_path = file_path % 'hd'
+        if not any(os.path.exists(f) for f in (ld_path, ld_path + '.gz', hd_path, hd_path + '.gz')):
+            print('    + NH3 Emissions File Not Found: ' + file_path % '{ld,hd}')
+            return {}
+
+        emis_by_region = {}
+        if os.path.exists(ld_path) or os.path.exists(ld_path + '.gz'):
+            emis_by_region = self.read_nh3_ld_file(ld_path)
+
+        if os.path.exists(hd_path) or os.path.exists(hd_path + '.gz'):
+            for region, table in self.read_emfac_file(hd_path).iteritems():
+                if region not in self.regions:
+                    continue
+                elif region in emis_by_region:
+                    emis_by_region[region].add_table(table)
+                else:
+                    emis_by_region[region] = table
+
+        return emis_by_region
+
+    def read_nh3_ld_file(self, file_path):
+        """ Read a statewide EMFAC LDV NH3 file, which has the same columns as the LDV emissions
+            files, but covers every sub-area and has no header.
+            File Format:
+            2018,     ,Alameda (SF),LDA,Gas,RUNEX,CAT,NH3,0.709346286138
+        """
+        if os.path.exists(file_path + '.gz'):
+            f = gzip.open(file_path + '.gz', 'rb')
+        else:
+            f = open(file_path, 'r')
+
+        lines = f.read().splitlines()
+        f.close()
+        cols = np.array([line.strip().split(',') for line in lines if line.strip()])
+        if not len(cols):
+            return {}
+
+        sub_area = np.array([self.REGION_CORRECTION.get(s, s) for s in cols[:, 2]])
+        emis_by_region = {}
+        for region in self.regions:
+            rows = sub_area == self.region_names[region]
+            if rows.any():
+                emis_by_region[region] = self._build_ld_table(cols, rows)
+
+        return emis_by_region
@@ -1,50 +1,248 @@
 
-from collections import defaultdict
 import numpy as np
 
 
-class EmissionsTable(defaultdict):
+class EmissionsTable(object):
     """ An emissions table object stores emissions values (unitless floats)
         by two indicies: EIC and then pollutant.
-        To support different models, there is no restriction on the type
-        used to define EICs or pollutants.
+        The table is columnar: an array of (integer) EICs, a list of pollutants, and a
+        float32 matrix of values[EIC, pollutant]. A dict-like view is kept for older callers:
+            table[eic][poll] = value
+        A value of zero is treated the same as a missing pollutant.
+        Once a table is frozen it is immutable, and can safely be shared between dates.
     """
 
-    def __init__(self):
-        defaultdict.__init__(self, lambda: defaultdict(np.float32))
+    def __init__(self, eics=None, pollutants=None, values=None):
+        self._eics = np.array([] if eics is None else eics, dtype=np.int64)
+        self._polls = [] if pollutants is None else list(pollutants)
+        self._eic_index = dict((eic, i) for i, eic in enumerate(self._eics.tolist()))
+        self._poll_index = dict((p, j) for j, p in enumerate(self._polls))
+        self._neics = len(self._eics)
+        self.frozen = False
+        if values is None:
+            self._values = np.zeros((self._neics, len(self._polls)), dtype=np.float32)
+        else:
+            self._values = np.array(values, dtype=np.float32).reshape((self._neics, len(self._polls)))
 
-    def __getitem__(self, key):
-        """ Getter method for emissions table """
-        return defaultdict.__getitem__(self, key)
+    @property
+    def eics(self):
+        """ array of all the EICs in the table """
+        return self._eics[:self._neics]
 
-    def __setitem__(self, key, val):
+    @property
+    def pollutants(self):
+        """ list of all the pollutants in the table """
+        return list(self._polls)
+
+    @property
+    def values(self):
+        """ the (EIC, pollutant) matrix of emissions values """
+        return self._values[:self._neics]
+
+    def add_table(self, table):
+        """ Combine this EmissionsTable object with another """
+        self._check_frozen()
+        cols = np.array([self._col(poll) for poll in table.pollutants], dtype=np.int32)
+        rows = np.array([self._row(eic) for eic in table.eics.tolist()], dtype=np.int32)
+        if len(rows) and len(cols):
+            self._values[np.ix_(rows, cols)] += table.values
+
+    def merge(self, table):
+        """ Create a new EmissionsTable, combining this table with another """
+        e = self.copy()
+        e.add_table(table)
+        return e
+
+    def freeze(self):
+        """ Make this table immutable, releasing any spare rows """
+        self.compact()
+        self.frozen = True
+
+    def scale(self, factors):
+        """ Create a new EmissionsTable, with the emissions multiplied by a single factor,
+            or by an array of factors (one per EIC).
+        """
+        factors = np.asarray(factors, dtype=np.float32)
+        if factors.ndim:
+            factors = factors[:, np.newaxis]
+
+        return EmissionsTable(self.eics, self._polls, self.values * factors)
+
+    def reduce_eics(self, eic_reduce):
+        """ Create a new EmissionsTable, where the EICs have been mapped to new EICs
+            (usually of a lower precision) and the emissions have been summed.
+        """
+        new_eics = np.array([eic_reduce(eic) for eic in self.eics.tolist()], dtype=np.int64)
+        eics, rows = np.unique(new_eics, return_inverse=True)
+        values = np.zeros((len(eics), len(self._polls)), dtype=np.float32)
+        np.add.at(values, rows, self.values)
+
+        return EmissionsTable(eics, self._polls, values)
+
+    def totals(self):
+        """ Sum the emissions, by pollutant, over all EICs """
+        sums = self.values.sum(axis=0, dtype=np.float64).astype(np.float32)
+        return dict((poll, sums[j]) for j, poll in enumerate(self._polls))
+
+    def copy(self):
+        """ create a deep copy of this object """
+        return EmissionsTable(self.eics, self._polls, self.values)
+
+    def compact(self):
+        """ release any spare rows, left over from growing the table one EIC at a time """
+        if len(self._values) > self._neics:
+            self._values = self._values[:self._neics].copy()
+            self._eics = self._eics[:self._neics].copy()
+
+    def _row(self, eic):
+        """ find (or create) the row for an EIC """
+        i = self._eic_index.get(eic)
+        if i is not None:
+            return i
+        elif self.frozen:
+            raise KeyError(eic)
+
+        # grow the table, by doubling, if we run out of rows
+        i = self._neics
+        if i == len(self._values):
+            size = max(16, 2 * i)
+            values = np.zeros((size, len(self._polls)), dtype=np.float32)
+            values[:i] = self._values[:i]
+            eics = np.zeros(size, dtype=np.int64)
+            eics[:i] = self._eics[:i]
+            self._values = values
+            self._eics = eics
+
+        self._eics[i] = eic
+        self._eic_index[eic] = i
+        self._neics += 1
+        return i
+
+    def _col(self, poll):
+        """ find (or create) the column for a pollutant """
+        j = self._poll_index.get(poll)
+        if j is not None:
+            return j
+        self._check_frozen()
+
+        j = len(self._polls)
+        self._values = np.hstack((self._values, np.zeros((len(self._values), 1), dtype=np.float32)))
+        self._polls.append(poll)
+        self._poll_index[poll] = j
+        return j
+
+    def _check_frozen(self):
+        if self.frozen:
+            raise TypeError('Frozen emissions tables can not be altered.')
+
+    # dict-like view, by EIC
+
+    def __getitem__(self, eic):
+        """ Getter method for emissions table (creates missing EICs, like a defaultdict) """
+        return EmissionsRow(self, self._row(eic))
+
+    def __setitem__(self, eic, val):
         """ Setter method for emissions table """
-        if type(val) != defaultdict:
+        self._check_frozen()
+        if not hasattr(val, 'iteritems'):
             raise TypeError('The emissions table must be two levels deep: EIC and pollutant.')
         for value in val.values():
             if type(value) != np.float32:
                 raise TypeError('Emissions values must be of type np.float32.')
-        defaultdict.__setitem__(self, key, val)
+        i = self._row(eic)
+        self._values[i] = 0.0
+        for poll, value in val.iteritems():
+            self._values[i, self._col(poll)] = value
 
-    def add_table(self, table):
-        """ Combine this EmissionsTable object with another """
-        for eic, eic_data in table.iteritems():
-            if not defaultdict.__contains__(self, eic):
-                defaultdict.__setitem__(self, eic, eic_data)
-            else:
-                for poll, value in eic_data.iteritems():
-                    eic_dict = defaultdict.__getitem__(self, eic)
-                    eic_dict[poll] += value
-
-    def __deepcopy__(self, table):
-        e = EmissionsTable()
-        for eic, eic_data in self.iteritems():
-            for poll, value in eic_data.iteritems():
-                #print poll, value  #MMD
-                e[eic][poll] = value
+    def __contains__(self, eic):
+        return eic in self._eic_index
 
-        return e
+    def __len__(self):
+        return self._neics
+
+    def __iter__(self):
+        return iter(self.eics.tolist())
+
+    def get(self, eic, default=None):
+        if eic not in self._eic_index:
+            return default
+        return EmissionsRow(self, self._eic_index[eic])
+
+    def keys(self):
+        return self.eics.tolist()
+
+    def iterkeys(self):
+        return self.__iter__()
+
+    def itervalues(self):
+        for i in xrange(self._neics):
+            yield EmissionsRow(self, i)
+
+    def iteritems(self):
+        for i, eic in enumerate(self.eics.tolist()):
+            yield eic, EmissionsRow(self, i)
+
+    def items(self):
+        return list(self.iteritems())
+
+    def __deepcopy__(self, memo):
+        return self.copy()
 
     def __repr__(self):
         return self.__class__.__name__ + '(' + \
-            str(dict((k, dict(v)) for k,v in self.iteritems()))[1: -1] + ')'
+            str(dict((k, dict(v.iteritems())) for k, v in self.iteritems()))[1: -1] + ')'
+
+
+class EmissionsRow(object):
+    """ A dict-like view of the emissions for one EIC in an EmissionsTable:
+        row[poll] = value
+        Only non-zero pollutants are listed.
+    """
+
+    __slots__ = ('_table', '_row')
+
+    def __init__(self, table, row):
+        self._table = table
+        self._row = row
+
+    def __getitem__(self, poll):
+        j = self._table._poll_index.get(poll)
+        if j is None:
+            return np.float32(0.0)
+        return self._table._values[self._row, j]
+
+    def __setitem__(self, poll, value):
+        self._table._check_frozen()
+        j = self._table._col(poll)
+        self._table._values[self._row, j] = value
+
+    def __contains__(self, poll):
+        return bool(self.__getitem__(poll))
+
+    def __len__(self):
+        return len(self.keys())
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def get(self, poll, default=None):
+        if poll not in self._table._poll_index:
+            return default
+        return self.__getitem__(poll)
+
+    def keys(self):
+        return [poll for poll, _ in self.iteritems()]
+
+    def values(self):
+        return [value for _, value in self.iteritems()]
+
+    def iteritems(self):
+        row = self._table._values[self._row]
+        for j in np.flatnonzero(row):
+            yield self._table._polls[j], row[j]
+
+    def items(self):
+        return list(self.iteritems())
+
+    def __repr__(self):
+        return self.__class__.__name__ + '(' + str(dict(self.iteritems())) + ')'
@@ -0,0 +1,75 @@
+
+from multiprocessing.sharedctypes import RawArray
+import numpy as np
+import os
+import tempfile
+
+
+class MemoryGrids(object):
+    """ Allocate float32 emissions grids in memory (the default). """
+
+    def zeros(self, shape):
+        """ a new float32 array of zeros """
+        return np.zeros(shape, dtype=np.float32)
+
+    def copy(self, grid):
+        """ a new copy of a float32 array """
+        return np.array(grid, dtype=np.float32)
+
+    def shared_zeros(self, shape):
+        """ a new float32 array of zeros, in memory that is shared with forked worker processes """
+        return np.frombuffer(RawArray('f', int(np.prod(shape))), dtype=np.float32).reshape(shape)
+
+
+class ScratchGrids(MemoryGrids):
+    """ Allocate float32 emissions grids out-of-core, in np.memmap files in a scratch directory.
+        The grids can be used just like in-memory arrays, but the OS can page them out to the
+        scratch disk instead of to swap. The files are unlinked as soon as they are mapped, so
+        the disk space is freed when the grids are, and nothing is left behind after a crash.
+        The grids are shared (not copied) with any forked worker processes.
+        NOTE: Use a fast, local disk for the scratch directory.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        if not os.path.exists(self.directory):
+            try:
+                os.makedirs(self.directory)
+            except OSError:
+                # another process may have just created it
+                if not os.path.isdir(self.directory):
+                    raise
+
+    def zeros(self, shape):
+        """ a new float32 array of zeros, mapped to a scratch file """
+        if not np.prod(shape):
+            return super(ScratchGrids, self).zeros(shape)
+
+        fd, file_path = tempfile.mkstemp(prefix='esta_', suffix='.f32', dir=self.directory)
+        os.close(fd)
+        try:
+            grid = np.memmap(file_path, dtype=np.float32, mode='w+', shape=shape)
+        finally:
+            os.remove(file_path)
+
+        return grid
+
+    def copy(self, grid):
+        """ a new copy of a float32 array, mapped to a scratch file """
+        new_grid = self.zeros(grid.shape)
+        new_grid[...] = grid
+        return new_grid
+
+    def shared_zeros(self, shape):
+        """ a new float32 array of zeros, mapped to a scratch file (which is always shared) """
+        return self.zeros(shape)
+
+
+def build_grid_storage(scratch_directory=None):
+    """ Build the in-memory grid storage, or the out-of-core storage if a scratch directory
+        is given. The two are interchangeable.
+    """
+    if scratch_directory:
+        return ScratchGrids(scratch_directory)
+
+    return MemoryGrids()
@@ -1,37 +1,113 @@
 
 import numpy as np
+from scratch_grids import MemoryGrids
 
 
 class SparseEmissions(object):
     """ This is a sparse-grid representation of emissions on a grid.
-        For every pollutant there is a NumPy array representing the
-        emissions in each cell of the grid.
+        Each pollutant is stored in one of two ways:
+            sparse: coordinate (COO) arrays of flat grid cells (row * ncols + col) and values,
+                    sorted by cell, for pollutants built up cell-by-cell with `add`
+            dense:  a NumPy array representing the emissions in each cell of the grid,
+                    for pollutants built from whole grids or subgrids
+        A sparse pollutant is switched to dense once it fills more than `fill_threshold`
+        of the grid, where the dense array becomes smaller.
+        The dense grids are allocated by the given grid storage: in memory (the default),
+        or out-of-core in scratch files.
         This grid represents all the emissions for a single EIC during a single hour.
     """
 
-    def __init__(self, nrows, ncols):
+    FILL_THRESHOLD = 0.25
+
+    def __init__(self, nrows, ncols, fill_threshold=None, grids=None):
         self._data = {}
+        self._sparse = {}
         self.pollutants = set()
         self.nrows = nrows
         self.ncols = ncols
+        self.fill_threshold = self.FILL_THRESHOLD if fill_threshold is None else fill_threshold
+        self.grids = MemoryGrids() if grids is None else grids
 
     def get(self, poll, cell):
         """ Getter method for sparse grid emissions """
-        return self._data[poll.upper()][cell]
+        poll = poll.upper()
+        if poll in self._sparse:
+            cells, values = self._sparse[poll]
+            keys = np.asarray(cell[0], dtype=np.int64) * self.ncols + cell[1]
+            if not len(cells):
+                return np.zeros(keys.shape, dtype=np.float32)[()]
+            i = np.minimum(np.searchsorted(cells, keys), len(cells) - 1)
+            return np.where(cells[i] == keys, values[i], np.float32(0.0))[()]
+
+        return self._data[poll][cell]
 
     def get_grid(self, poll):
         """ Get a copy of an entire pollutant grid """
-        return self._data[poll.upper()].copy()
+        poll = poll.upper()
+        if poll in self._sparse:
+            return self._to_dense(poll)
+
+        return self._data[poll].copy()
+
+    def is_sparse(self, poll):
+        """ Is this pollutant currently stored sparsely? """
+        return poll.upper() in self._sparse
+
+    def nnz(self, poll):
+        """ the number of stored (possibly zero) grid cells for a pollutant """
+        poll = poll.upper()
+        if poll in self._sparse:
+            return len(self._sparse[poll][0])
+
+        return self.nrows * self.ncols
+
+    def cell_table(self, polls, min_row=0, max_row=None, min_col=0, max_col=None):
+        """ Find every grid cell, in row-major order, where any of the given pollutants
+            has non-zero emissions. The search can be limited to a subgrid (exclusive of the
+            max row and column).
+            Output: (rows, cols, values[cell, pollutant])
+        """
+        max_row = self.nrows if max_row is None else max_row
+        max_col = self.ncols if max_col is None else max_col
+        polls = [poll.upper() for poll in polls]
+
+        # find all the non-zero cells, for any pollutant
+        cells = [np.array([], dtype=np.int64)]
+        for poll in polls:
+            if poll in self._sparse:
+                keys, values = self._sparse[poll]
+                cells.append(keys[values != 0.0])
+            else:
+                rows, cols = np.nonzero(self._data[poll][min_row:max_row, min_col:max_col])
+                cells.append((rows + min_row).astype(np.int64) * self.ncols + cols + min_col)
+        cells = np.unique(np.concatenate(cells))
+
+        # limit the cells to the subgrid
+        rows = cells // self.ncols
+        cols = cells % self.ncols
+        inside = (rows >= min_row) & (rows < max_row) & (cols >= min_col) & (cols < max_col)
+        rows = rows[inside]
+        cols = cols[inside]
+
+        values = np.zeros((len(rows), len(polls)), dtype=np.float32)
+        for j, poll in enumerate(polls):
+            values[:, j] = self.get(poll, (rows, cols))
+
+        return rows, cols, values
 
     def mask(self, min_val=0.0):
         """ Build a mask of all the grid cells with non-zero emissions
             for any pollutant.
             Note: This method gives no performance gaurantees.
         """
-        polls = [p.upper() for p in self.pollutants]
-        mask = self._data[polls[0]] > min_val
-        for poll in polls[1:]:
-            mask += self._data[poll] > min_val
+        mask = np.zeros((self.nrows, self.ncols), dtype=bool)
+        for poll in self.pollutants:
+            poll = poll.upper()
+            if poll in self._sparse:
+                cells, values = self._sparse[poll]
+                mask.ravel()[cells[values > min_val]] = True
+            else:
+                mask += self._data[poll] > min_val
 
         return mask
 
@@ -41,15 +117,22 @@ class SparseEmissions(object):
         """
         if poll not in self.pollutants:
             self.pollutants.add(poll.upper())
-            self._data[poll.upper()] = np.zeros((self.nrows, self.ncols), dtype=np.float32)
+            self._data[poll.upper()] = self._new_grid()
 
     def add(self, poll, cell, value):
-        """ Setter method for sparse grid emissions """
-        if poll.upper() not in self.pollutants:
-            self.pollutants.add(poll.upper())
-            self._data[poll.upper()] = np.zeros((self.nrows, self.ncols), dtype=np.float32)
+        """ Setter method for sparse grid emissions
+            The cell can be a single (row, col), or a (rows, cols) pair of arrays.
+            New pollutants are stored sparsely.
+        """
+        poll = poll.upper()
+        if poll not in self.pollutants:
+            self.pollutants.add(poll)
+            self._sparse[poll] = (np.array([], dtype=np.int64), np.array([], dtype=np.float32))
 
-        self._data[poll.upper()][cell] += value
+        if poll in self._sparse:
+            self._add_sparse(poll, cell, value)
+        else:
+            self._data[poll][cell] += value
 
     def add_nocheck(self, poll, cell, value):
         """ Setter method for sparse grid emissions
@@ -57,14 +140,61 @@ class SparseEmissions(object):
                   already exists or if it is the correct dimensions. This is a faster version of
                   the `add` method, but more dangerous if you are not doing these checks elsewhere.
         """
-        self._data[poll.upper()][cell] += value
+        if poll.upper() in self._sparse:
+            self._add_sparse(poll.upper(), cell, value)
+        else:
+            self._data[poll.upper()][cell] += value
+
+    def _add_sparse(self, poll, cell, value):
+        """ add values to a sparse pollutant, one per cell, summing any repeated cells """
+        keys = np.atleast_1d(np.asarray(cell[0], dtype=np.int64) * self.ncols + cell[1])
+        values = np.array(value, dtype=np.float32, ndmin=1)
+        if len(values) == 1 and len(keys) > 1:
+            values = np.repeat(values, len(keys))
+
+        old_keys, old_values = self._sparse[poll]
+        if len(old_keys) or (len(keys) > 1 and not (keys[1:] > keys[:-1]).all()):
+            keys, values = self._coalesce(np.concatenate((old_keys, keys)),
+                                          np.concatenate((old_values, values)))
+
+        self._sparse[poll] = (keys, values)
+        if len(keys) > self.fill_threshold * self.nrows * self.ncols:
+            self._data[poll] = self._to_dense(poll, self._new_grid())
+            del self._sparse[poll]
+
+    @staticmethod
+    def _coalesce(keys, values):
+        """ sort the cells, and sum any repeats (in their original order, in float32) """
+        cells, inverse = np.unique(keys, return_inverse=True)
+        sums = np.zeros(len(cells), dtype=np.float32)
+        np.add.at(sums, inverse, values)
+        return cells, sums
+
+    def _new_grid(self):
+        """ allocate a new dense grid of zeros, from the grid storage """
+        return self.grids.zeros((self.nrows, self.ncols))
+
+    def _to_dense(self, poll, grid=None):
+        """ build a dense grid from a sparse pollutant (by default, a temporary in-memory grid) """
+        cells, values = self._sparse[poll]
+        if grid is None:
+            grid = np.zeros((self.nrows, self.ncols), dtype=np.float32)
+        grid[cells // self.ncols, cells % self.ncols] = values
+        return grid
+
+    def _make_dense(self, poll):
+        """ make sure a pollutant exists, and is stored as a dense grid """
+        if poll not in self.pollutants:
+            self.pollutants.add(poll)
+            self._data[poll] = self._new_grid()
+        elif poll in self._sparse:
+            self._data[poll] = self._to_dense(poll, self._new_grid())
+            del self._sparse[poll]
 
     def add_grid(self, poll, grid):
         """ Add an entire grid of pollutant emissions to an existing pollutant.
         """
-        if poll.upper() not in self.pollutants:
-            self.pollutants.add(poll.upper())
-            self._data[poll.upper()] = np.zeros((self.nrows, self.ncols), dtype=np.float32)
+        self._make_dense(poll.upper())
 
         if grid.shape != (self.nrows, self.ncols):
             raise ValueError('Arrays has the wrong dimensions: ' + str(grid.shape))
@@ -78,12 +208,20 @@ class SparseEmissions(object):
         """
         self._data[poll] += grid
 
+    def set_grid(self, poll, grid):
+        """ Set an entire grid of pollutant emissions, replacing any that already exist.
+            NOTE: The grid is not copied, so it may be a view into a larger array.
+        """
+        if grid.shape != (self.nrows, self.ncols):
+            raise ValueError('Arrays has the wrong dimensions: ' + str(grid.shape))
+        self.pollutants.add(poll.upper())
+        self._sparse.pop(poll.upper(), None)
+        self._data[poll.upper()] = grid
+
     def add_subgrid(self, poll, subgrid, min_row, max_row, min_col, max_col):
         """ Add a subgrid of emissions to a particular pollutant.
         """
-        if poll.upper() not in self.pollutants:
-            self.pollutants.add(poll.upper())
-            self._data[poll.upper()] = np.zeros((self.nrows, self.ncols), dtype=np.float32)
+        self._make_dense(poll.upper())
 
         self._data[poll.upper()][min_row:max_row, min_col:max_col] += subgrid
 
@@ -98,33 +236,184 @@ class SparseEmissions(object):
     def join(self, se):
         """ add another sparse emissions object to this one """
         for poll in self.pollutants.intersection(se.pollutants):
-            self._data[poll.upper()] += se._data[poll]
+            poll = poll.upper()
+            if poll in se._sparse:
+                cells, values = se._sparse[poll]
+                if poll in self._sparse:
+                    self._add_sparse(poll, (cells // self.ncols, cells % self.ncols), values)
+                else:
+                    self._data[poll][cells // self.ncols, cells % self.ncols] += values
+            else:
+                self._make_dense(poll)
+                self._data[poll] += se._data[poll]
 
         for poll in se.pollutants.difference(self.pollutants):
             self.pollutants.add(poll.upper())
-            self._data[poll.upper()] = se._data[poll.upper()]
+            if poll.upper() in se._sparse:
+                self._sparse[poll.upper()] = se._sparse[poll.upper()]
+            else:
+                self._data[poll.upper()] = se._data[poll.upper()]
 
     def scale(self, factor):
         """ Scale all of the emissions in this grid by the given factor """
         for poll in self.pollutants:
-            self._data[poll.upper()] *= np.float32(factor)
+            if poll.upper() in self._sparse:
+                cells, values = self._sparse[poll.upper()]
+                self._sparse[poll.upper()] = (cells, values * np.float32(factor))
+            else:
+                self._data[poll.upper()] *= np.float32(factor)
 
     def copy(self):
         """ create a deep copy of this object """
-        e = SparseEmissions(self.nrows, self.ncols)
+        e = SparseEmissions(self.nrows, self.ncols, self.fill_threshold, self.grids)
         e.pollutants = set(self.pollutants)
 
         for poll in self.pollutants:
-            e._data[poll.upper()] = self._data[poll.upper()].copy()
+            if poll.upper() in self._sparse:
+                cells, values = self._sparse[poll.upper()]
+                e._sparse[poll.upper()] = (cells.copy(), values.copy())
+            else:
+                e._data[poll.upper()] = self.grids.copy(self._data[poll.upper()])
 
         return e
 
     def iteritems(self):
         """ Returning the iterator object for the data, without exposing the dictionary
+            NOTE: Sparse pollutants are returned as (new) dense grids.
         """
-        return self._data.iteritems()
+        if not self._sparse:
+            return self._data.iteritems()
+
+        return ((poll, self.get_grid(poll)) for poll in self.pollutants)
 
     def __repr__(self):
         """ standard Python helper to allow for str(x) and print(x) """
         return self.__class__.__name__ + '(' + \
-            str(dict((k, str(v)) for k, v in self._data.iteritems()))[1: -1] + ')'
+            str(dict((k, str(v)) for k, v in self.iteritems()))[1: -1] + ')'
+
+
+class SubgridEmissions(SparseEmissions):
+    """ A statewide grid of emissions, stored as the (box-sized) subgrids that were added to it,
+        for each pollutant. The full grid of a pollutant is only built when it is requested,
+        so the memory used follows the size of the region boxes, not the size of the domain.
+        NOTE: The subgrids are not copied, so they should not be changed after they are added.
+    """
+
+    def __init__(self, nrows, ncols, fill_threshold=None, grids=None):
+        super(SubgridEmissions, self).__init__(nrows, ncols, fill_threshold, grids)
+        self._subgrids = {}
+
+    def get(self, poll, cell):
+        """ Getter method for sparse grid emissions """
+        return self.get_grid(poll)[cell]
+
+    def get_grid(self, poll):
+        """ Build an entire pollutant grid, from all of its subgrids """
+        poll = poll.upper()
+        if poll in self._subgrids:
+            grid = np.zeros((self.nrows, self.ncols), dtype=np.float32)
+            for min_row, max_row, min_col, max_col, subgrid in self._subgrids[poll]:
+                grid[min_row:max_row, min_col:max_col] += subgrid
+            return grid
+
+        return super(SubgridEmissions, self).get_grid(poll)
+
+    def mask(self, min_val=0.0):
+        """ Build a mask of all the grid cells with non-zero emissions
+            for any pollutant.
+        """
+        mask = np.zeros((self.nrows, self.ncols), dtype=bool)
+        for poll in self.pollutants:
+            mask += self.get_grid(poll) > min_val
+
+        return mask
+
+    def add_poll(self, poll):
+        """ Add a single pollutant, with no subgrids """
+        if poll.upper() not in self.pollutants:
+            self.pollutants.add(poll.upper())
+            self._subgrids[poll.upper()] = []
+
+    def _make_dense(self, poll):
+        """ make sure a pollutant exists, and is stored as a dense grid """
+        if poll in self._subgrids:
+            self._data[poll] = self.grids.copy(self.get_grid(poll))
+            del self._subgrids[poll]
+        super(SubgridEmissions, self)._make_dense(poll)
+
+    def add(self, poll, cell, value):
+        """ Setter method for sparse grid emissions """
+        self._make_dense(poll.upper())
+        super(SubgridEmissions, self).add(poll, cell, value)
+
+    def add_nocheck(self, poll, cell, value):
+        """ Setter method for sparse grid emissions """
+        self.add(poll, cell, value)
+
+    def add_grid_nocheck(self, poll, grid):
+        """ Add an entire grid of pollutant emissions to an existing pollutant. """
+        self.add_grid(poll, grid)
+
+    def set_grid(self, poll, grid):
+        """ Set an entire grid of pollutant emissions, replacing any that already exist. """
+        self._subgrids.pop(poll.upper(), None)
+        super(SubgridEmissions, self).set_grid(poll, grid)
+
+    def add_subgrid(self, poll, subgrid, min_row, max_row, min_col, max_col):
+        """ Add a subgrid of emissions to a particular pollutant.
+            Subgrids with no emissions are not stored.
+        """
+        poll = poll.upper()
+        if poll not in self.pollutants:
+            self.add_poll(poll)
+        elif poll not in self._subgrids:
+            self._data[poll][min_row:max_row, min_col:max_col] += subgrid
+            return
+
+        if subgrid.any():
+            self._subgrids[poll].append((min_row, max_row, min_col, max_col, subgrid))
+
+    def add_subgrid_nocheck(self, poll, subgrid, min_row, max_row, min_col, max_col):
+        """ Add a subgrid of emissions to a particular pollutant. """
+        self.add_subgrid(poll, subgrid, min_row, max_row, min_col, max_col)
+
+    def join(self, se):
+        """ add another sparse emissions object to this one """
+        for poll in se.pollutants:
+            poll = poll.upper()
+            if poll in self._subgrids and isinstance(se, SubgridEmissions) and poll in se._subgrids:
+                self._subgrids[poll] = self._subgrids[poll] + se._subgrids[poll]
+            else:
+                self.add_grid(poll, se.get_grid(poll))
+
+    def scale(self, factor):
+        """ Scale all of the emissions in this grid by the given factor """
+        for poll, subgrids in self._subgrids.iteritems():
+            self._subgrids[poll] = [s[:4] + (s[4] * np.float32(factor), ) for s in subgrids]
+        for poll in self._data:
+            self._data[poll] *= np.float32(factor)
+        for poll, (cells, values) in self._sparse.items():
+            self._sparse[poll] = (cells, values * np.float32(factor))
+
+    def copy(self):
+        """ create a deep copy of this object """
+        e = SubgridEmissions(self.nrows, self.ncols, self.fill_threshold, self.grids)
+        e.pollutants = set(self.pollutants)
+
+        for poll in self.pollutants:
+            poll = poll.upper()
+            if poll in self._subgrids:
+                e._subgrids[poll] = [s[:4] + (s[4].copy(), ) for s in self._subgrids[poll]]
+            elif poll in self._sparse:
+                cells, values = self._sparse[poll]
+                e._sparse[poll] = (cells.copy(), values.copy())
+            else:
+                e._data[poll] = self.grids.copy(self._data[poll])
+
+        return e
+
+    def iteritems(self):
+        """ Returning the iterator object for the data, without exposing the dictionary
+            NOTE: The full pollutant grids are built one at a time, as they are requested.
+        """
+        return ((poll, self.get_grid(poll)) for poll in self.pollutants)
@@ -8,6 +8,7 @@ import time
 from src.core.output_files import OutputFiles, build_arb_file_path
 from src.core.output_writer import OutputWriter
 from src.core.version import __version__ as version
+from src.scaling.scaled_emissions import DayBlockScaledEmissions, HourlyScaledEmissions, ScaledEmissions
 
 
 class CmaqNetcdfWriter(OutputWriter):
@@ -15,6 +16,9 @@ class CmaqNetcdfWriter(OutputWriter):
         NOTE: This class currently only supports 2D emissions.
     """
 
+    # (complevel, shuffle) settings to try in benchmark mode (a complevel of zero is uncompressed)
+    BENCHMARK_SETTINGS = [(0, False), (1, False), (1, True), (4, False), (4, True), (6, True), (9, True)]
+
     def __init__(self, config, position):
         super(CmaqNetcdfWriter, self).__init__(config, position)
         self.nrows = int(self.config['GridInfo']['rows'])
@@ -27,6 +31,21 @@ class CmaqNetcdfWriter(OutputWriter):
         self.units = self.load_gspro(self.config['Output']['gspro_file'])
         self.drop_polls = ['PM10', 'PM25']
 
+        # NetCDF compression and chunking settings
+        self.complevel = int(self.config['Output'].get('complevel', 4))
+        self.shuffle = True
+        if 'shuffle' in self.config['Output']:
+            self.shuffle = self.config.getboolean('Output', 'shuffle')
+        self.chunksizes = None
+        if self.config['Output'].get('chunksizes'):
+            self.chunksizes = tuple(self.config.getlist('Output', 'chunksizes', int))
+        self.least_significant_digit = None
+        if self.config['Output'].get('least_significant_digit'):
+            self.least_significant_digit = int(self.config['Output']['least_significant_digit'])
+        self.benchmark = False
+        if 'netcdf_benchmark' in self.config['Output']:
+            self.benchmark = self.config.getboolean('Output', 'netcdf_benchmark')
+
         # build some custom text to put in the NetCDF header
         file_desc = "regions: " + ' '.join([str(r) for r in self.regions]) + \
                     ", gspro: " + basename(self.config['Output']['gspro_file'])
@@ -108,21 +127,21 @@ class CmaqNetcdfWriter(OutputWriter):
         ''' A helper method to spread the work of creating a CMAQ-ready NetCDF file
             into more than one method. There is a lot of boilerplate to deal with.
         '''
-        # re-write date in Julian date format
-        d = dt.strptime(date, self.date_format)
-        jdate = int(str(d.year) + dt(self.base_year, d.month, d.day).strftime('%j'))
-
         # final output file path
         out_path = build_arb_file_path(dt.strptime(date, self.date_format), 'nc7', self.grid_size,
                                        self.directory, self.base_year, self.start_date.year,
                                        self.version)
-        print('    + writing: ' + out_path)
 
-        # create empty netcdf file (including file path)
-        rootgrp, gmt_shift = self._create_netcdf(out_path, jdate)
+        # try each of the compression settings, on the first date only
+        if self.benchmark:
+            self.benchmark = False
+            if isinstance(scaled_emissions, HourlyScaledEmissions):
+                # the hours can only be read once, so hold the whole day in memory
+                scaled_emissions = self._read_hours(scaled_emissions)
+            self._benchmark(scaled_emissions, date, os.path.dirname(out_path))
 
-        # fill netcdf file with data
-        self._fill_grid(scaled_emissions, date, rootgrp, gmt_shift)
+        print('    + writing: ' + out_path)
+        self._write_file(scaled_emissions, date, out_path)
 
         # compress output file
         #if is_last_date:
@@ -132,9 +151,67 @@ class CmaqNetcdfWriter(OutputWriter):
 
         return [out_path]
 
-    def _create_netcdf(self, out_path, jdate):
+    def _write_file(self, scaled_emissions, date, out_path):
+        ''' Create a CMAQ-ready NetCDF file and fill it with the emissions for one date '''
+        # re-write date in Julian date format
+        d = dt.strptime(date, self.date_format)
+        jdate = int(str(d.year) + dt(self.base_year, d.month, d.day).strftime('%j'))
+
+        # create empty netcdf file (including file path), with one chunk per day block
+        chunksizes = self.chunksizes
+        if chunksizes is None and isinstance(scaled_emissions, DayBlockScaledEmissions):
+            chunksizes = (25, 1, self.nrows, self.ncols)
+        rootgrp, gmt_shift = self._create_netcdf(out_path, jdate, chunksizes)
+
+        # fill netcdf file with data
+        self._fill_grid(scaled_emissions, date, rootgrp, gmt_shift)
+
+    def _benchmark(self, scaled_emissions, date, directory):
+        ''' Write the same date with each of the benchmark compression settings,
+            and report the write time and file size of each.
+        '''
+        print('    + benchmarking NetCDF settings for: ' + date)
+        complevel, shuffle = self.complevel, self.shuffle
+        out_path = os.path.join(directory, 'benchmark.' + date + '.nc7')
+
+        for setting in self.BENCHMARK_SETTINGS:
+            self.complevel, self.shuffle = setting
+            start = time.time()
+            self._write_file(scaled_emissions, date, out_path)
+            seconds = time.time() - start
+            size = os.path.getsize(out_path)
+            os.remove(out_path)
+
+            print('      complevel: %d  shuffle: %-5s  write time: %7.2f s  file size: %8.1f MB' %
+                  (self.complevel, self.shuffle, seconds, size / 1048576.0))
+
+        self.complevel, self.shuffle = complevel, shuffle
+
+    @staticmethod
+    def _read_hours(scaled_emissions):
+        ''' read all the hours of a streamed date into a regular ScaledEmissions object '''
+        e = ScaledEmissions()
+        for hour, sparse_emis in scaled_emissions.hours():
+            e.set(scaled_emissions.region, scaled_emissions.date, hour, scaled_emissions.eic, sparse_emis)
+
+        return e
+
+    def _variable_options(self, chunksizes=None):
+        ''' the compression and chunking keyword arguments for a new NetCDF variable '''
+        options = {'zlib': self.complevel > 0, 'shuffle': self.shuffle and self.complevel > 0}
+        if self.complevel > 0:
+            options['complevel'] = self.complevel
+        if chunksizes:
+            options['chunksizes'] = chunksizes
+        if self.least_significant_digit is not None:
+            options['least_significant_digit'] = self.least_significant_digit
+
+        return options
+
+    def _create_netcdf(self, out_path, jdate, chunksizes=None):
         ''' Creates a blank CMAQ-ready NetCDF file, including all the important
             boilerplate and header information. But does not fill in any emissions data.
+            Optionally, set the chunk shape of the emissions variables.
         '''
         # define some header variables
         current_date = int(time.strftime("%Y%j"))
@@ -150,16 +227,18 @@ class CmaqNetcdfWriter(OutputWriter):
         _ = rootgrp.createDimension('COL', self.ncols)        # Domain: number of columns
 
         # define TFLAG Variable
-        TFLAG = rootgrp.createVariable('TFLAG', 'i4', ('TSTEP', 'VAR', 'DATE-TIME',), zlib=True)
+        TFLAG = rootgrp.createVariable('TFLAG', 'i4', ('TSTEP', 'VAR', 'DATE-TIME',),
+                                       zlib=self.complevel > 0, complevel=max(self.complevel, 1))
         TFLAG.units = '<YYYYDDD,HHMMSS>'
         TFLAG.long_name = 'TFLAG'
         TFLAG.var_desc = 'Timestep-valid flags:  (1) YYYYDDD or (2) HHMMSS'
 
         # define variables and attribute definitions
+        options = self._variable_options(chunksizes)
         varl = ''
         for spec in self.species:
             units = self.units[spec]
-            rootgrp.createVariable(spec, 'f4', ('TSTEP', 'LAY', 'ROW', 'COL'), zlib=True)
+            rootgrp.createVariable(spec, 'f4', ('TSTEP', 'LAY', 'ROW', 'COL'), **options)
             rootgrp.variables[spec].long_name = spec
             rootgrp.variables[spec].units = units
             rootgrp.variables[spec].var_desc = 'emissions'
@@ -220,34 +299,71 @@ class CmaqNetcdfWriter(OutputWriter):
         ''' Fill the entire modeling domain with a 3D grid for each pollutant.
             Fill the emissions values in each grid cell, for each polluant.
             Create a separate grid set for each date.
+            If the scaled emissions are streamed by hour, each hour is written (and freed)
+            as soon as it is gridded.
         '''
-        # loop through the different levels of the scaled emissions dictionary
-        region_data = scaled_emissions.data[-999]  # -999 is default EIC for pre-speciated emissions
-        day_data = region_data.get(date, {})
-        for hour, hr_data in day_data.iteritems():
-            # hr should start with 0, not 1
-            hr = hour - 1
-            # adjust hr for DST
-            if gmt_shift == '19':
-                hr = (hr - 1) % 24
-
-            sparse_emis = hr_data[-999]
-
-            for poll in sparse_emis.pollutants:
-                if poll.upper() in self.drop_polls:
-                    continue
-                if poll.upper() not in rootgrp.variables:
-                    print('No variable for: ' + poll.upper())
-                    continue
-
-                grid = sparse_emis.get_grid(poll)
-                rootgrp.variables[poll.upper()][hr,0,:,:] = grid
-
-                if not hr:
-                    rootgrp.variables[poll.upper()][24,0,:,:] = grid
+        if isinstance(scaled_emissions, DayBlockScaledEmissions):
+            self._write_day_block(rootgrp, scaled_emissions, gmt_shift)
+            rootgrp.close()
+            return
+        elif isinstance(scaled_emissions, HourlyScaledEmissions):
+            hours = scaled_emissions.hours()
+        else:
+            # loop through the different levels of the scaled emissions dictionary
+            region_data = scaled_emissions.data[-999]  # -999 is default EIC for pre-speciated emissions
+            day_data = region_data.get(date, {})
+            hours = ((hour, hr_data[-999]) for hour, hr_data in day_data.iteritems())
+
+        for hour, sparse_emis in hours:
+            self._write_hour(rootgrp, hour, sparse_emis, gmt_shift)
 
         rootgrp.close()
 
+    def _write_day_block(self, rootgrp, scaled_emissions, gmt_shift):
+        ''' Write the whole (25, 1, row, col) slab of each pollutant, in one call.
+            The first hour is also written as the 25th time step.
+        '''
+        block = scaled_emissions.block
+        if gmt_shift == '19':
+            # adjust for DST: each time step holds the next hour
+            hours = [(hr + 1) % 24 for hr in xrange(24)] + [1]
+        else:
+            hours = None
+            block[:, 24] = block[:, 0]
+
+        for poll, i in scaled_emissions.species_index.iteritems():
+            if poll.upper() in self.drop_polls:
+                continue
+            if poll.upper() not in rootgrp.variables:
+                print('No variable for: ' + poll.upper())
+                continue
+
+            slab = block[i] if hours is None else block[i, hours]
+            rootgrp.variables[poll.upper()][0:25, 0, :, :] = slab
+
+    def _write_hour(self, rootgrp, hour, sparse_emis, gmt_shift):
+        ''' Write the emissions grid of each pollutant, for a single hour (1 to 24).
+            The first hour is also written as the 25th time step.
+        '''
+        # hr should start with 0, not 1
+        hr = hour - 1
+        # adjust hr for DST
+        if gmt_shift == '19':
+            hr = (hr - 1) % 24
+
+        for poll in sparse_emis.pollutants:
+            if poll.upper() in self.drop_polls:
+                continue
+            if poll.upper() not in rootgrp.variables:
+                print('No variable for: ' + poll.upper())
+                continue
+
+            grid = sparse_emis.get_grid(poll)
+            rootgrp.variables[poll.upper()][hr,0,:,:] = grid
+
+            if not hr:
+                rootgrp.variables[poll.upper()][24,0,:,:] = grid
+
     @staticmethod
     def load_gspro(file_path):
         ''' Grab the units for each species from the GSPRO file
@@ -63,19 +63,21 @@ class Pmeds1Writer(OutputWriter):
         for hr, hr_data in hourly_emis.iteritems():
             for eic, sparse_emis in hr_data.iteritems():
                 polls = [(p, self.COLUMNS[p]) for p in sparse_emis.pollutants if p in self.COLUMNS]
-                for i in xrange(y_min, y_max):
-                    for j in xrange(x_min, x_max):
-                        emis_found = False
-                        emis = ['', '', '', '', '', '']
-                        for poll, col in polls:
-                            value = sparse_emis.get(poll, (i, j))
-                            if value > self.MIN_EMIS:
-                                emis[col] = '%.5f' % (value * self.STONS_2_KG)
-                                emis_found = True
-
-                        # build PMEDS line
-                        if emis_found:
-                            f.write(self._build_pmeds1_line(region, date, jul_day, hr, eic, (i, j), emis))
+
+                # only visit the grid cells with emissions
+                rows, cols, values = sparse_emis.cell_table([p for p, _ in polls], y_min, y_max, x_min, x_max)
+                for i, j, cell_values in zip(rows.tolist(), cols.tolist(), values):
+                    emis_found = False
+                    emis = ['', '', '', '', '', '']
+                    for k, (poll, col) in enumerate(polls):
+                        value = cell_values[k]
+                        if value > self.MIN_EMIS:
+                            emis[col] = '%.5f' % (value * self.STONS_2_KG)
+                            emis_found = True
+
+                    # build PMEDS line
+                    if emis_found:
+                        f.write(self._build_pmeds1_line(region, date, jul_day, hr, eic, (i, j), emis))
 
         f.close()
         return self._combine_regions(date, out_path)
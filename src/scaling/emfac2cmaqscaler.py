@@ -3,11 +3,16 @@ from collections import defaultdict
 from copy import deepcopy
 from datetime import datetime as dt
 from datetime import timedelta
+from multiprocessing import current_process, Lock, Pool
 import numpy as np
 from src.core.date_utils import DOW, find_holidays
 from src.core.emissions_scaler import EmissionsScaler
-from src.scaling.scaled_emissions import ScaledEmissions
-from src.emissions.sparse_emissions import SparseEmissions
+from src.scaling.scaled_emissions import DayBlockScaledEmissions, HourlyScaledEmissions, ScaledEmissions
+from src.emissions.scratch_grids import build_grid_storage
+from src.emissions.sparse_emissions import SparseEmissions, SubgridEmissions
+
+# the scaler being run in parallel, inherited by the region worker processes when they are forked
+_SCALER = None
 
 
 class Emfac2CmaqScaler(EmissionsScaler):
@@ -31,9 +36,23 @@ class Emfac2CmaqScaler(EmissionsScaler):
         self.winter_gsref = Emfac2CmaqScaler.load_gsref(self.config['Output']['winter_gsref_file'])
         self.gsref = self.summer_gsref  # to be used, during the run, to point to the right file
         self.species = set()
+        self.speciation = {}  # compiled speciation coefficients, by (season, NOx region)
+        self._speciated = {}  # the last speciated emissions table, by region
         self.gspro = self.load_gspro(self.config['Output']['gspro_file'])
         self.diesel_nox = self.load_nox_file(self.config['Output']['nox_file'])
         self.month2season = self.read_month_to_season()
+        self.region_processes = int(self.config['Scaling'].get('region_processes', 1))
+        self.region_subgrids = False
+        if 'region_subgrids' in self.config['Scaling']:
+            self.region_subgrids = self.config.getboolean('Scaling', 'region_subgrids')
+        self.stream_hours = False
+        if 'stream_hours' in self.config['Scaling']:
+            self.stream_hours = self.config.getboolean('Scaling', 'stream_hours')
+        self.day_block = False
+        if 'day_block' in self.config['Scaling']:
+            self.day_block = self.config.getboolean('Scaling', 'day_block')
+        # statewide grids are kept in memory, or out-of-core in a scratch directory
+        self.grids = build_grid_storage(self.config['Scaling'].get('scratch_directory'))
 
     def scale(self, emissions, spatial_surr, temp_surr):
         """ Master method to scale emissions using spatial and temporal surrogates.
@@ -42,175 +61,320 @@ class Emfac2CmaqScaler(EmissionsScaler):
                        emis_data[region][date string] = EmissionsTable
                        EmissionsTable[EIC][pollutant] = value
             Spatial Surrogates: SpatialSurrogateData[region][label] = SpatialSurrogate()
-            Temporal Surrogates: {'diurnal': {}, 'dow': {}}
+            Temporal Surrogates: {'diurnal': {}, 'dow': {}, 'daily': DailyTemporalFactors}
             OUTPUT FORMAT:
             ScaledEmissions: data[region][date][hr][eic] = SparseEmissions
                              SparseEmissions[pollutant][(grid, cell)] = value
             NOTE: This function is a generator and will `yield` emissions file-by-file.
+                  If streaming hours, each date is yielded as HourlyScaledEmissions, and each
+                  hour is only gridded when the writer reads it.
+                  If using a day block, each date is yielded as DayBlockScaledEmissions.
         """
         self._load_species(emissions)
 
+        # build the dense surrogate rasters once, before any worker processes are forked
+        if not spatial_surr.rasters:
+            spatial_surr.build_rasters(self.region_boxes)
+
+        # grid the regions in parallel, unless we are already inside a worker process
+        if self.region_processes > 1 and not current_process().daemon:
+            for e in self._scale_parallel(emissions, spatial_surr, temp_surr):
+                yield e
+            return
+
         # find start date
-        today = dt(self.base_year, self.start_date.month, self.start_date.day)
+        today = deepcopy(self.base_start_date)
 
         # loop through all the dates in the period
         while today <= self.base_end_date:
             # find the DOW
             date = today.strftime(self.date_format)
             today += timedelta(days=1)
-            if date[5:] in find_holidays(self.base_year):
-                dow = 'holi'
-            else:
-                by_date = str(self.base_year) + date[4:]
-                dow = DOW[dt.strptime(by_date, self.date_format).weekday()]
+            dow = self._find_dow(date)
+
+            # grid one hour at a time, as the writer asks for it
+            if self.stream_hours:
+                statewide = self._prebuild_statewide()
+                yield HourlyScaledEmissions(-999, date, -999, set(statewide.pollutants),
+                                            self._scale_hours(emissions, spatial_surr, temp_surr,
+                                                              date, dow, today.month, statewide))
+                continue
+
+            # grid the whole day into one contiguous (species, hour, row, col) block
+            if self.day_block:
+                yield self._scale_day_block(emissions, spatial_surr, temp_surr, date, dow, today.month)
+                continue
 
             # create a statewide emissions object
             e = self._prebuild_scaled_emissions(date)
 
             for region in self.regions:
-                if date not in emissions.data[region]:
-                    continue
+                # handle region bounding box (limits are inclusive: {'lat': (51, 92), 'lon': (156, 207)})
+                box = self.region_boxes[region]
+
+                for hr, sparse_emis in self._scale_region(emissions, spatial_surr, temp_surr,
+                                                          region, date, dow, today.month):
+                    e.add_subgrid_nocheck(-999, date, hr + 1, -999, sparse_emis, box)
+
+            yield e
 
-                # use the speciation from the correct season
-                if self.month2season[region][today.month] == 's':
-                    self.gsref = self.summer_gsref
+    def _scale_parallel(self, emissions, spatial_surr, temp_surr):
+        """ Grid the regions for each date in a pool of worker processes.
+            Each worker adds its box-sized subgrids into a statewide (species, hour, row, col)
+            buffer in shared memory. A lock serializes the additions, so the result only
+            differs from the serial sum by the order of float32 additions.
+            NOTE: This function is a generator and will `yield` emissions file-by-file.
+                  The yielded grids are views into the shared buffer, which is zeroed for
+                  the next date, so they must be written before the next date is requested.
+        """
+        global _SCALER
+        species = sorted(self.species)
+        self._species_index = dict((spec, i) for i, spec in enumerate(species))
+
+        # allocate the shared statewide buffer before forking, so all workers see it
+        shape = (len(species), 25 if self.day_block else 24, self.nrows, self.ncols)
+        self._shared_grid = self.grids.shared_zeros(shape)
+        self._lock = Lock()
+        self._inputs = (emissions, spatial_surr, temp_surr)
+        _SCALER = self
+        pool = Pool(min(self.region_processes, len(self.regions)))
+
+        try:
+            today = deepcopy(self.base_start_date)
+            while today <= self.base_end_date:
+                date = today.strftime(self.date_format)
+                today += timedelta(days=1)
+                dow = self._find_dow(date)
+
+                # grid every region into the shared buffer
+                pool.map(_grid_region, [(region, date, dow, today.month) for region in self.regions], 1)
+
+                # wrap the shared buffer in a statewide emissions object
+                if self.day_block:
+                    e = DayBlockScaledEmissions(-999, date, -999, self._shared_grid, self._species_index,
+                                                self.species)
                 else:
-                    self.gsref = self.winter_gsref
+                    e = ScaledEmissions()
+                    for hr in xrange(24):
+                        se = SparseEmissions(self.nrows, self.ncols)
+                        for spec in self.species:
+                            se.set_grid(spec, self._shared_grid[self._species_index[spec], hr])
+                        # copy the set, like the serial pre-built grids, to keep the same species order
+                        se.pollutants = set(se.pollutants)
+                        e.set(-999, date, hr + 1, -999, se)
+
+                yield e
+                self._shared_grid[:] = 0.0
+        finally:
+            pool.close()
+            pool.join()
+            self._shared_grid = None
+            self._inputs = None
+            _SCALER = None
+
+    def _grid_region_shared(self, region, date, dow, month):
+        """ Worker process: grid a single region for one date, and add the results into the
+            shared statewide buffer.
+        """
+        emissions, spatial_surr, temp_surr = self._inputs
+        box = self.region_boxes[region]
+        min_row = box['lat'][0]
+        max_row = box['lat'][1] + 1
+        min_col = box['lon'][0]
+        max_col = box['lon'][1] + 1
+
+        for hr, sparse_emis in self._scale_region(emissions, spatial_surr, temp_surr,
+                                                  region, date, dow, month):
+            with self._lock:
+                for poll, subgrid in sparse_emis.iteritems():
+                    self._shared_grid[self._species_index[poll], hr, min_row:max_row, min_col:max_col] += subgrid
+
+    def _scale_day_block(self, emissions, spatial_surr, temp_surr, date, dow, month):
+        """ Grid every region for a single date, adding the box-sized subgrids directly into
+            a statewide (species, 25, row, col) block.
+        """
+        species_index = dict((spec, i) for i, spec in enumerate(self._species))
+        block = self.grids.zeros((len(self._species), 25, self.nrows, self.ncols))
+
+        for region in self.regions:
+            box = self.region_boxes[region]
+            min_row = box['lat'][0]
+            max_row = box['lat'][1] + 1
+            min_col = box['lon'][0]
+            max_col = box['lon'][1] + 1
+
+            for hr, sparse_emis in self._scale_region(emissions, spatial_surr, temp_surr,
+                                                      region, date, dow, month):
+                for poll, subgrid in sparse_emis.iteritems():
+                    block[species_index[poll], hr, min_row:max_row, min_col:max_col] += subgrid
+
+        return DayBlockScaledEmissions(-999, date, -999, block, species_index, self.species)
+
+    def _scale_hours(self, emissions, spatial_surr, temp_surr, date, dow, month, statewide):
+        """ Grid every region for a single date, one hour at a time.
+            This method is a generator, and will `yield` a statewide SparseEmissions object
+            for each hour of the day, as (hour, SparseEmissions), copied from the pre-built one.
+        """
+        # start gridding each region, in order (regions with no emissions yield nothing)
+        regions = [(self.region_boxes[region],
+                    self._scale_region(emissions, spatial_surr, temp_surr, region, date, dow, month))
+                   for region in self.regions]
+
+        for hr in xrange(24):
+            se = statewide.copy()
+            for box, hours in regions:
+                hr_emis = next(hours, None)
+                if hr_emis is None:
+                    continue
 
-                # handle region bounding box (limits are inclusive: {'lat': (51, 92), 'lon': (156, 207)})
-                box = self.region_boxes[region]
+                for poll, subgrid in hr_emis[1].iteritems():
+                    se.add_subgrid_nocheck(poll, subgrid, box['lat'][0], box['lat'][1] + 1,
+                                           box['lon'][0], box['lon'][1] + 1)
 
-                # apply DOW factors (this line is long for performance reasons)
-                emis_table = self._apply_factors(deepcopy(emissions.data[region][date]),
-                                                 temp_surr['dow'][region][dow])
+            yield hr + 1, se
 
-                # find diurnal factors by hour
-                factors_by_hour = temp_surr['diurnal'][region][dow]
+    def _scale_region(self, emissions, spatial_surr, temp_surr, region, date, dow, month):
+        """ Temporally scale, speciate, and grid the emissions for a single region and date.
+            This method is a generator, and will `yield` a box-sized SparseEmissions object
+            for each hour of the day.
+        """
+        if date not in emissions.data[region]:
+            return
 
-                # pull today's spatial surrogate
-                spatial_surrs = spatial_surr.data[region]
+        # use the speciation from the correct season
+        if self.month2season[region][month] == 's':
+            self.gsref = self.summer_gsref
+            speciation = self.speciation[('s', self._nox_region(region))]
+        else:
+            self.gsref = self.winter_gsref
+            speciation = self.speciation[('w', self._nox_region(region))]
 
-                # loop through each hour of the day
-                for hr in xrange(24):
-                    sparse_emis = self._apply_spatial_surrs(self._apply_factors(emis_table, factors_by_hour[hr]),
-                                                            spatial_surrs, region, box, hr)
-                    e.add_subgrid_nocheck(-999, date, hr + 1, -999, sparse_emis, box)
+        # handle region bounding box (limits are inclusive: {'lat': (51, 92), 'lon': (156, 207)})
+        box = self.region_boxes[region]
 
-            yield e
+        # speciate the daily emissions, once (dates that share the same table share the result)
+        table = emissions.data[region][date]
+        last = self._speciated.get(region)
+        if last and last[0] is table and last[1] is speciation:
+            eics, spec_emis = last[2:]
+        else:
+            eics, spec_emis = self._speciate(table, speciation)
+            self._speciated[region] = (table, speciation, eics, spec_emis)
+
+        # find the combined DOW and diurnal factors, by EIC and hour
+        factors = temp_surr['daily'].eic_factors(region, dow, [self.eic_info[eic][0] for eic in eics])
 
-    def _apply_spatial_surrs(self, emis_table, spatial_surrs, region, box, hr=0):
-        """ Apply the spatial surrogates for each hour to this EIC and create a dictionary of
-            sparely-gridded emissions (one for each eic).
+        # loop through each hour of the day
+        for hr in xrange(24):
+            yield hr, self._apply_spatial_surrs(eics, spec_emis, factors[:, hr],
+                                                spatial_surr.rasters, region, box, hr)
+
+    def _find_dow(self, date):
+        """ find the day-of-week (or holiday) for a given date string """
+        if date[5:] in find_holidays(self.base_year):
+            return 'holi'
+
+        by_date = str(self.base_year) + date[4:]
+        return DOW[dt.strptime(by_date, self.date_format).weekday()]
+
+    def _speciate(self, emis_table, speciation):
+        """ Speciate all the EICs in an emissions table at once:
+            (EIC x pollutant) . (EIC x pollutant x species)
             Data Types:
             EmissionsTable[EIC][pollutant] = value
-            spatial_surrs[label] = SpatialSurrogate()
-                                   SpatialSurrogate[(grid, cell)] = fraction
-            region_box: {'lat': (51, 92), 'lon': (156, 207)}
-            output: {EIC: SparseEmissions[pollutant][(grid, cell)] = value}
+            speciation: (EIC index, pollutant index, coefficients[EIC, pollutant, species])
+            output: ([EIC], emissions[EIC, species])
         """
-        # determine the region for HD diesel NOx
-        r = 'default'
-        if str(region) in self.diesel_nox:
-            r = str(region)
-        # determine the year for HD diesel NOx
-        yr = self.start_date.year
-        if self.start_date.year not in self.diesel_nox[r]:
-            yr = min(self.diesel_nox[r].iterkeys(), key=lambda y: abs(y - self.start_date.year))
+        eic_index, poll_index, coeffs = speciation
+
+        eics = emis_table.keys()
+        emis = np.zeros((len(eics), len(poll_index)), dtype=np.float32)
+        for j, pol in enumerate(emis_table.pollutants):
+            emis[:, poll_index[pol.upper()]] += emis_table.values[:, j]
 
-        hono_fract, no_fract, no2_fract = self.diesel_nox[r][yr]
+        rows = np.array([eic_index[eic] for eic in eics], dtype=np.int32)
+        return eics, np.einsum('ep,eps->es', emis, coeffs[rows])
 
+    def _apply_spatial_surrs(self, eics, spec_emis, factors, rasters, region, box, hr=0):
+        """ Temporally scale the speciated emissions for one hour, and apply the spatial surrogates
+            to create a box-sized SparseEmissions object.
+            Data Types:
+            eics: [EIC]
+            spec_emis: np.array[EIC, species] (daily)
+            factors: np.array[EIC] (DOW * diurnal factor for this hour)
+            rasters[(region, label)] = np.array (box-sized surrogate fractions)
+            region_box: {'lat': (51, 92), 'lon': (156, 207)}
+            output: SparseEmissions[pollutant][(grid, cell)] = value
+        """
         # examine bounding box
-        min_lat = box['lat'][0]
-        min_lon = box['lon'][0]
         num_rows = box['lat'][1] - box['lat'][0] + 1
         num_cols = box['lon'][1] - box['lon'][0] + 1
 
         # pre-build emissions object
         se = self._prebuild_sparse_emissions(num_rows, num_cols)
 
-        # grid emissions, by EIC
-        for eic in emis_table:
-            label = self.eic_info[eic][1]
+        # ignore EICs with zerod emissions this hour
+        keep = np.flatnonzero(factors)
+        if not len(keep):
+            return se
+
+        # collapse the EICs into one species vector per spatial surrogate label
+        labels = []
+        label_index = {}
+        rows = np.zeros(len(keep), dtype=np.int32)
+        for i, e in enumerate(keep):
+            label = self.eic_info[eics[e]][1]
 
             # check if the surrogate is by period
-            if label not in spatial_surrs:
+            if (region, label) not in rasters:
                 label += '_' + str(hr)
 
-            # build default spatial surrogate for this EIC
-            ss = np.zeros((num_rows, num_cols), dtype=np.float32)
-            try:
-                for cell, cell_fraction in spatial_surrs[label].iteritems():
-                    ss[cell[0] - min_lat, cell[1] - min_lon] = cell_fraction
-            except KeyError:
-                err = ('Spatial Surrogate grid cell (%d, %d) found outside of bounding box' + \
-                       ' %s in region %d.') % (cell[0], cell[1], box, region)
-                raise KeyError(err)
-
-            # find all relevant species and molecular weights for this EIC
-            species_data = self.gspro['default'].copy()
-            for group, profile in self.gsref[eic].iteritems():
-                species_data[group] = self.gspro[profile][group]
-
-            # adjust NOx for HD diesel vehicles
-            if eic in self.HD_DSL_CATS:
-                species_data['NOX'] = {'HONO': {'mass_fract': hono_fract, 'weight': np.float32(47.013)},
-                                       'NO':   {'mass_fract': no_fract,   'weight': np.float32(30.006)},
-                                       'NO2':  {'mass_fract': no2_fract,  'weight': np.float32(46.006)}}
+            if label not in label_index:
+                label_index[label] = len(labels)
+                labels.append(label)
+            rows[i] = label_index[label]
 
-            # speciate by pollutant, while gridding
-            for pol, value in emis_table[eic].iteritems():
-                if not value:
-                    continue
+        label_emis = np.zeros((len(labels), spec_emis.shape[1]), dtype=np.float32)
+        np.add.at(label_emis, rows, spec_emis[keep] * factors[keep, np.newaxis])
 
-                # loop through each species in this pollutant group
-                poll = pol.upper()
-                for spec, spec_data in species_data[poll].iteritems():
-                    se.add_grid_nocheck(spec, (value * spec_data['mass_fract'] * self.STONS_HR_2_G_SEC / spec_data['weight']) * ss)
-
-            # add NH3, based on NH3/CO fractions
-            #if 'CO' in emis_table[eic]:
-            #    nh3_fraction = self.nh3_fractions.get(region, {}).get(eic, 0)
-            #    if not nh3_fraction:
-            #        continue
-
-                # add NH3 based on its relation to CO
-                #se.add_grid_nocheck('NH3', (emis_table[eic]['CO'] * nh3_fraction * (self.STONS_HR_2_G_SEC / self.gspro['default']['NH3']['NH3']['weight'])) * ss)
+        # grid emissions, applying each spatial surrogate once
+        for i, label in enumerate(labels):
+            ss = rasters[(region, label)]
+            for j in np.flatnonzero(label_emis[i]):
+                se.add_grid_nocheck(self._species[j], label_emis[i, j] * ss)
 
         return se
 
-    def _apply_factors(self, emissions_table, factors):
-        """ Apply DOW or diurnal factors to an emissions table, altering the table.
-            Date Types:
-            EmissionsTable[EIC][pollutant] = value
-            factors = {'LD': 1.0, 'LM': 0.5, 'HH': 0.0, ...}
-        """
-        new_emis_table = {}
-
-        # loop through all EICs and add time-scaled data
-        for eic, emis in emissions_table.iteritems():
-            factor = factors[self.eic_info[eic][0]]
-            if factor:
-                # ignore EICs with zerod emissions
-                new_emis_table[eic] = dict((p, v * factor) for p, v in emis.iteritems())
-
-        return new_emis_table
-
     def _prebuild_scaled_emissions(self, date):
         """ Pre-Build a ScaledEmissions object, for the On-Road NetCDF case, where:
             region = -999
             EIC = -999
             And each pollutant grid is pre-built in the SparseEmissions object.
+            If using region subgrids, the statewide grids are only built when they are written.
         """
         e = ScaledEmissions()
-        se = self._prebuild_sparse_emissions(self.nrows, self.ncols)
+        se = self._prebuild_statewide()
         for hr in xrange(1, 25):
             e.set(-999, date, hr, -999, se.copy())
 
         return e
 
-    def _prebuild_sparse_emissions(self, nrows, ncols):
+    def _prebuild_statewide(self):
+        ''' pre-build a statewide SparseEmissions object, with all relevant species
+            (using region subgrids, if requested)
+        '''
+        if not self.region_subgrids:
+            return self._prebuild_sparse_emissions(self.nrows, self.ncols, self.grids)
+
+        se = SubgridEmissions(self.nrows, self.ncols, grids=self.grids)
+        for spec in self.species:
+            se.add_poll(spec)
+
+        return se
+
+    def _prebuild_sparse_emissions(self, nrows, ncols, grids=None):
         ''' pre-process to add all relevant species to SparseEmissions object '''
-        se = SparseEmissions(nrows, ncols)
+        se = SparseEmissions(nrows, ncols, grids=grids)
         for spec in self.species:
             se.add_poll(spec)
 
@@ -222,7 +386,7 @@ class Emfac2CmaqScaler(EmissionsScaler):
         eics = set()
         for region in emissions.data:
             for date in emissions.data[region]:
-                eics.update(set(emissions.data[region][date].keys()))
+                eics.update(emissions.data[region][date].keys())
 
         # now find all the species we care about for this run
         if self.config['Output']['dpmout']:
@@ -237,6 +401,65 @@ class Emfac2CmaqScaler(EmissionsScaler):
                 for species in self.gspro[profile][group]:
                     self.species.add(species)
 
+        # compile the speciation for each season, and each HD diesel NOx region
+        polls = set()
+        for region in emissions.data:
+            for date in emissions.data[region]:
+                polls.update(p.upper() for p in emissions.data[region][date].pollutants)
+
+        self._species = sorted(self.species)
+        self.speciation = {}
+        self._speciated = {}
+        for nox_region in set(self._nox_region(region) for region in self.regions):
+            for season, gsref in (('s', self.summer_gsref), ('w', self.winter_gsref)):
+                self.speciation[(season, nox_region)] = self._compile_speciation(gsref, eics, polls,
+                                                                                 nox_region)
+
+    def _compile_speciation(self, gsref, eics, polls, nox_region):
+        """ Compile the GSREF, GSPRO, and HD diesel NOx fractions into a dense array of coefficients,
+            that convert short tons per hour of each pollutant into grams (or moles) per second
+            of each species.
+            Output: ({EIC: i}, {POLLUTANT: j}, coefficients[i, j, species])
+        """
+        # determine the year for HD diesel NOx
+        yr = self.start_date.year
+        if yr not in self.diesel_nox[nox_region]:
+            yr = min(self.diesel_nox[nox_region].iterkeys(), key=lambda y: abs(y - self.start_date.year))
+
+        hono_fract, no_fract, no2_fract = self.diesel_nox[nox_region][yr]
+        diesel_nox = {'HONO': {'mass_fract': hono_fract, 'weight': np.float32(47.013)},
+                      'NO':   {'mass_fract': no_fract,   'weight': np.float32(30.006)},
+                      'NO2':  {'mass_fract': no2_fract,  'weight': np.float32(46.006)}}
+
+        eics = sorted(eic for eic in eics if eic in gsref)
+        polls = sorted(polls)
+        spec_index = dict((spec, i) for i, spec in enumerate(self._species))
+        coeffs = np.zeros((len(eics), len(polls), len(self._species)), dtype=np.float32)
+
+        for i, eic in enumerate(eics):
+            # find all relevant species and molecular weights for this EIC
+            species_data = self.gspro['default'].copy()
+            for group, profile in gsref[eic].iteritems():
+                species_data[group] = self.gspro[profile][group]
+
+            # adjust NOx for HD diesel vehicles
+            if eic in self.HD_DSL_CATS:
+                species_data['NOX'] = diesel_nox
+
+            for j, poll in enumerate(polls):
+                for spec, spec_data in species_data[poll].iteritems():
+                    coeffs[i, j, spec_index[spec]] += spec_data['mass_fract'] * self.STONS_HR_2_G_SEC / spec_data['weight']
+
+        return (dict((eic, i) for i, eic in enumerate(eics)),
+                dict((poll, j) for j, poll in enumerate(polls)),
+                coeffs)
+
+    def _nox_region(self, region):
+        """ find the region key used in the HD diesel NOx file """
+        if str(region) in self.diesel_nox:
+            return str(region)
+        return 'default'
+
     def _read_nh3_inventory(self, inv_file):
         """ read the NH3/CO values from the inventory and generate the NH3/CO fractions
             File format:
@@ -426,3 +649,12 @@ class Emfac2CmaqScaler(EmissionsScaler):
          74676512107031, 74676512107032, 76076112100000, 76076412100000, 77276112100000, 77276412100000,
          77276512100000, 77876112100000, 77876412100000, 77876512100000, 77976112100000, 77976412100000,
          77976512100000])
+
+
+def _grid_region(args):
+    """ Worker process: grid a single (region, date, dow, month) into the shared buffer """
+    try:
+        _SCALER._grid_region_shared(*args)
+    except SystemExit as e:
+        # a sys.exit() would kill the worker and hang the pool
+        raise RuntimeError(str(e))
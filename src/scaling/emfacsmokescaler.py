@@ -8,6 +8,7 @@ from scaled_emissions import ScaledEmissions
 from src.core.date_utils import DOW, find_holidays
 from src.core.emissions_scaler import EmissionsScaler
 from src.core.eic_utils import eic_reduce
+from src.emissions.emissions_table import EmissionsTable
 from src.emissions.sparse_emissions import SparseEmissions
 import pdb
 
@@ -38,7 +39,7 @@ class EmfacSmokeScaler(EmissionsScaler):
                             emis_data[region][date string] = EmissionsTable
                             EmissionsTable[EIC][pollutant] = value
             Spatial Surrogates: SpatialSurrogateData[region][veh][act] = SpatialSurrogate()
-            Temporal Surrogates: {'diurnal': {}, 'dow': {}}
+            Temporal Surrogates: {'diurnal': {}, 'dow': {}, 'daily': DailyTemporalFactors}
             OUTPUT FORMAT:
             ScaledEmissions: data[region][date][hr][eic] = SparseEmissions
                                 SparseEmissions[pollutant][(grid, cell)] = value
@@ -71,21 +72,18 @@ class EmfacSmokeScaler(EmissionsScaler):
                 if self.by_region:
                     e = ScaledEmissions()
 
-                # apply DOW factors (this line is long for performance reasons)
-                emis_table = self._apply_factors(deepcopy(emissions.data[region][date]),
-                                                 temp_surr['dow'][region][dow])
-
-                # find diurnal factors by hour
-                factors_by_hour = temp_surr['diurnal'][region][dow]
+                # find the combined DOW and diurnal factors, by EIC and hour
+                emis_table = emissions.data[region][date]
+                factors = temp_surr['daily'].eic_factors(region, dow,
+                                                         [self.eic_info[eic][0] for eic in emis_table])
 
                 # pull today's spatial surrogate
                 spatial_surrs = spatial_surr.data[region]
 
                 # loop through each hour of the day
                 for hr in xrange(24):
-                    # apply diurnal, then spatial profiles (this line long for performance reasons)
-                    emis_dict = self._apply_spatial_surrs(self._apply_factors(deepcopy(emis_table),
-                                                                              factors_by_hour[hr]),
+                    # apply temporal, then spatial profiles
+                    emis_dict = self._apply_spatial_surrs(self._apply_factors(emis_table, factors[:, hr]),
                                                           spatial_surrs, region, dow_num, hr)
 
                     for eic, sparse_emis in emis_dict.iteritems():
@@ -148,24 +146,17 @@ class EmfacSmokeScaler(EmissionsScaler):
         return inv
 
     def _apply_factors(self, emissions_table, factors):
-        """ Apply DOW or diurnal factors to an emissions table, altering the table.
+        """ Apply the combined DOW and diurnal factors to the daily emissions,
+            creating a new emissions table for one hour.
             Date Types:
             EmissionsTable[EIC][pollutant] = value
-            factors = {'LD': 1.0, 'LM': 0.5, 'HH': 0.0, ...}
+            factors[EIC] = DOW * diurnal factor
         """
-        eics2delete = []
-        for eic in emissions_table:
-            factor = factors[self.eic_info[eic][0]]
-            if factor:
-                emissions_table[eic].update((x, y * factor) for x, y in emissions_table[eic].items())
-            else:
-                eics2delete.append(eic)
-
         # don't bother with EICs if they have no emissions
-        for eic in eics2delete:
-            del emissions_table[eic]
+        keep = np.flatnonzero(factors)
 
-        return emissions_table
+        return EmissionsTable(emissions_table.eics[keep], emissions_table.pollutants,
+                              emissions_table.values[keep] * factors[keep, np.newaxis])
 
     def _apply_spatial_surrs(self, emis_table, spatial_surrs, region, dow=2, hr=0):
         """ Apply the spatial surrogates for each hour to this EIC and create a dictionary of
@@ -173,7 +164,7 @@ class EmfacSmokeScaler(EmissionsScaler):
             Data Types:
             EmissionsTable[EIC][pollutant] = value
             spatial_surrs[label] = SpatialSurrogate()
-                                   SpatialSurrogate[(grid, cell)] = fraction
+                                   SpatialSurrogate.rows/cols/fractions = arrays
             output: {EIC: SparseEmissions[pollutant][(grid, cell)] = value}
         """
         e = {}
@@ -192,9 +183,10 @@ class EmfacSmokeScaler(EmissionsScaler):
                 continue
 
             # add emissions to sparse grid
+            surrogate = spatial_surrs[label]
             for poll, value in emis_table[eic].iteritems():
-                for cell, fraction in spatial_surrs[label].iteritems():
-                    se.add(poll, cell, value * fraction)
+                if len(surrogate):
+                    se.add(poll, (surrogate.rows, surrogate.cols), value * surrogate.fractions)
 
             # add NH3, based on CO fractions
             #nh3_fraction = self.nh3_fractions.get(region, {}).get(eic, np.float32(0.0))
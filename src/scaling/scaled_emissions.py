@@ -20,7 +20,7 @@ class ScaledEmissions(object):
     def set(self, region, date, hr, eic, poll_grid):
         """ Setter method for the scaled emissions inventory """
         # type validation
-        if type(poll_grid) != SparseEmissions:
+        if not isinstance(poll_grid, SparseEmissions):
             raise TypeError('Only sparse-grid emissions can be in the scaled emissions inventory.')
 
         # auto-fill the multi-level dictionary format, to hide this from the user
@@ -78,3 +78,66 @@ class ScaledEmissions(object):
 
     def __repr__(self):
         return self.__class__.__name__ + '(' + dict.__repr__(self.data)[1: -1] + ')'
+
+
+class HourlyScaledEmissions(ScaledEmissions):
+    """ The scaled emissions for a single date, where each hour is only gridded when a writer
+        asks for it. This lets a writer stream one hour at a time to disk, instead of holding
+        the whole day in memory.
+        The hours are a generator of (hour, SparseEmissions), so they can only be read once.
+    """
+
+    def __init__(self, region, date, eic, pollutants, hours):
+        super(HourlyScaledEmissions, self).__init__()
+        self.data = {region: {date: {}}}
+        self.region = region
+        self.date = date
+        self.eic = eic
+        self._pollutants = pollutants
+        self._hours = hours
+
+    def set(self, region, date, hr, eic, poll_grid):
+        raise TypeError('Hourly scaled emissions are read-only.')
+
+    def hours(self):
+        """ Generator: the (hour, SparseEmissions) pairs for the date, in order.
+            Each hour is gridded as it is requested, and should be written before the next.
+        """
+        if self._hours is None:
+            raise ValueError('The hourly scaled emissions for %s have already been read.' % self.date)
+
+        hours, self._hours = self._hours, None
+        for hr, poll_grid in hours:
+            yield hr, poll_grid
+
+    def pollutants(self):
+        """ return a set of all the pullants that will be in each hour """
+        polls = set()
+        polls.update(self._pollutants)
+        return polls
+
+
+class DayBlockScaledEmissions(ScaledEmissions):
+    """ The scaled emissions for a single date, held in one contiguous float32 block:
+            block[species, hour, row, col]
+        There are 25 hours in the block, so a writer can store each species' whole day in one
+        call; the last hour is left for the writer to fill (usually with a copy of the first).
+        The usual data[region][date][hr][eic] = SparseEmissions is also filled, with views into
+        the block, for other writers.
+    """
+
+    def __init__(self, region, date, eic, block, species_index, species=None):
+        super(DayBlockScaledEmissions, self).__init__()
+        self.block = block
+        self.species_index = species_index
+        if species is None:
+            species = sorted(species_index)
+
+        nrows, ncols = block.shape[2:]
+        for hr in xrange(24):
+            se = SparseEmissions(nrows, ncols)
+            for spec in species:
+                se.set_grid(spec, block[species_index[spec], hr])
+            # copy the set, like the pre-built grids, to keep the same species order
+            se.pollutants = set(se.pollutants)
+            self.set(region, date, hr + 1, eic, se)
@@ -0,0 +1,130 @@
+
+import json
+import numpy as np
+import os
+
+
+class CompiledSurrogateStore(object):
+    """ A compiled, binary version of a set of normalized spatial surrogates.
+        For each label, there are CSR-style arrays: region offsets, cell indices (row * ncols + col),
+        and normalized fractions. The file can be memory-mapped, so loading it is nearly free and
+        several processes on the same node will share the same pages.
+        File Format:
+            8-byte magic string
+            8-byte (little-endian) header length
+            JSON header: grid description, regions, labels, and the location of each array
+            arrays, each aligned to 8 bytes (after the header)
+    """
+
+    MAGIC = 'ESTASRG1'
+    ALIGN = 8
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        f = open(file_path, 'rb')
+        magic = f.read(len(self.MAGIC))
+        if magic != self.MAGIC:
+            f.close()
+            raise ValueError('Not a compiled spatial surrogate file: ' + file_path)
+        header_length = int(np.fromstring(f.read(8), dtype='<u8')[0])
+        header = json.loads(f.read(header_length))
+        f.close()
+
+        self.grid = header['grid']
+        self.nrows = header['rows']
+        self.ncols = header['columns']
+        self.labels = [str(label) for label in header['labels']]
+        self.regions = header['regions']
+        self._region_index = dict((r, i) for i, r in enumerate(self.regions))
+        self._arrays = header['arrays']
+        self._start = self._data_start(header_length)
+        self._data = np.memmap(file_path, dtype=np.uint8, mode='r')
+
+    def get(self, label, region):
+        """ Getter method: the (rows, cols, fractions) arrays for a single label and region.
+            The arrays are read-only views into the memory-mapped file.
+        """
+        i = self._region_index.get(region)
+        if i is None:
+            return self._empty()
+        offsets = self._array(label, 'offsets')
+        start, end = offsets[i], offsets[i + 1]
+        cells = self._array(label, 'cells')[start:end]
+        fractions = self._array(label, 'fractions')[start:end]
+
+        return cells // self.ncols, cells % self.ncols, fractions
+
+    def _array(self, label, name):
+        """ a view of one array in the memory-mapped file """
+        dtype, offset, length = self._arrays[label][name]
+        dtype = np.dtype(str(dtype))
+        offset += self._start
+        return self._data[offset:offset + length * dtype.itemsize].view(dtype)
+
+    @staticmethod
+    def _empty():
+        """ the (rows, cols, fractions) arrays of a region with no surrogate """
+        return np.array([], dtype=np.int32), np.array([], dtype=np.int32), np.array([], dtype=np.float32)
+
+    @staticmethod
+    def grid_shape(grid):
+        """ Parse the (rows, columns) from a SMOKE #GRID line:
+            #GRID CA_State4k -684000. -564000. 4000. 4000. 321 291 1 LAMBERT METERS ...
+        """
+        ln = grid.split()
+        return int(ln[7]), int(ln[6])
+
+    @classmethod
+    def write(cls, file_path, grid, surrogates):
+        """ Write a set of normalized spatial surrogates to a compiled binary file.
+            Input Format: surrogates[label][region] = (rows, cols, fractions)
+        """
+        nrows, ncols = cls.grid_shape(grid)
+        labels = sorted(surrogates)
+        regions = sorted(set(r for label in labels for r in surrogates[label]))
+
+        # build the CSR-style arrays for each label
+        arrays = []
+        for label in labels:
+            offsets = np.zeros(len(regions) + 1, dtype='<i8')
+            cells = []
+            fractions = []
+            for i, region in enumerate(regions):
+                rows, cols, fracs = surrogates[label].get(region, cls._empty())
+                cells.append(np.asarray(rows, dtype=np.int64) * ncols + cols)
+                fractions.append(np.asarray(fracs, dtype=np.float32))
+                offsets[i + 1] = offsets[i] + len(fracs)
+            arrays.append((label, 'offsets', offsets))
+            arrays.append((label, 'cells', np.concatenate(cells).astype('<i4')))
+            arrays.append((label, 'fractions', np.concatenate(fractions).astype('<f4')))
+
+        # lay out the arrays, relative to the end of the header
+        locations = {}
+        offset = 0
+        for label, name, array in arrays:
+            offset += -offset % cls.ALIGN
+            locations.setdefault(label, {})[name] = (array.dtype.str, offset, len(array))
+            offset += array.nbytes
+
+        header = {'grid': grid, 'rows': nrows, 'columns': ncols, 'regions': regions, 'labels': labels,
+                  'arrays': locations}
+        header_text = json.dumps(header, sort_keys=True)
+        start = cls._data_start(len(header_text))
+
+        # write to a temporary file first, so a crash never leaves a partial file
+        tmp_path = file_path + '.tmp'
+        f = open(tmp_path, 'wb')
+        f.write(cls.MAGIC)
+        f.write(np.array([len(header_text)], dtype='<u8').tostring())
+        f.write(header_text)
+        for label, name, array in arrays:
+            f.write('\0' * (start + locations[label][name][1] - f.tell()))
+            f.write(array.tostring())
+        f.close()
+        os.rename(tmp_path, file_path)
+
+    @classmethod
+    def _data_start(cls, header_length):
+        """ the arrays start at the first aligned byte after the header """
+        start = len(cls.MAGIC) + 8 + header_length
+        return start + -start % cls.ALIGN
@@ -0,0 +1,39 @@
+
+import os
+from compiled_surrogate_store import CompiledSurrogateStore
+from spatial_surrogate import SpatialSurrogate
+from src.core.spatial_loader import SpatialLoader
+from spatial_surrogate_data import SpatialSurrogateData
+
+
+class CompiledSpatialSurrogateLoader(SpatialLoader):
+    ''' This class reads a compiled, binary spatial surrogate file, which was built from a set of
+        SMOKE v4 spatial surrogates using `compile_surrogates.py`.
+        The file is memory-mapped, and the surrogates in it have already been normalized,
+        so there is no text to parse.
+    '''
+
+    def __init__(self, config, position):
+        super(CompiledSpatialSurrogateLoader, self).__init__(config, position)
+        self.compiled_surrogates = self.config['Surrogates']['compiled_surrogates']
+        self.nrows = int(self.config['GridInfo']['rows'])
+        self.ncols = int(self.config['GridInfo']['columns'])
+        self.regions = self.config.parse_regions('Regions', 'regions')
+
+    def load(self, spatial_surrogates, temporal_surrogates):
+        """ Overriding the abstract loader method to read a compiled spatial surrogate file. """
+        # initialize surroagates, if needed
+        if not spatial_surrogates:
+            spatial_surrogates = SpatialSurrogateData()
+        spatial_surrogates.init_regions(self.regions)
+
+        store = CompiledSurrogateStore(os.path.join(self.directory, self.compiled_surrogates))
+        if (store.nrows, store.ncols) != (self.nrows, self.ncols):
+            raise ValueError('The compiled spatial surrogates are on a different grid: ' + store.grid)
+
+        for label in store.labels:
+            for region in self.regions:
+                rows, cols, fractions = store.get(label, region)
+                spatial_surrogates.set_nocheck(region, label, SpatialSurrogate(rows, cols, fractions))
+
+        return spatial_surrogates, temporal_surrogates
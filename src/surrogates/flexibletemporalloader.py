@@ -2,6 +2,7 @@
 import os
 import numpy as np
 from src.core.temporal_loader import TemporalLoader
+from src.surrogates.temporal_surrogate import DailyTemporalFactors, TemporalProfiles
 
 
 class FlexibleTemporalLoader(TemporalLoader):
@@ -23,6 +24,10 @@ class FlexibleTemporalLoader(TemporalLoader):
         # load diurnal time profiles
         temporal_surrogates['diurnal'] = FlexibleTemporalLoader.load_diurnal(self.diurnal_path)
 
+        # combine the DOW and diurnal profiles into daily hourly factors
+        temporal_surrogates['daily'] = DailyTemporalFactors(temporal_surrogates['dow'],
+                                                            temporal_surrogates['diurnal'])
+
         return temporal_surrogates
 
     @staticmethod
@@ -35,33 +40,18 @@ class FlexibleTemporalLoader(TemporalLoader):
             Alameda,sun,00,0.020204,0.040504,0.060651,0.0
             Alameda,sun,01,0.012772,0.038892,0.055813,0.0
         """
-        surrs = {}
-        f = open(file_path, 'r')
-        labels = f.readline().rstrip().split(',')[3:]
-        for line in f.xreadlines():
-            # read line
-            ln = line.rstrip().split(',')
-            region = int(ln[0])
-            dow = ln[1]
-            hr = int(ln[2])
-            if hr < 0 or hr > 23:
-                raise ValueError('Hour in Diurnal CSV outside valid range 0 to 23: ' + ln[2])
-
-            values = [np.float32(val) for val in ln[3:]]
-            if len(values) != len(labels):
-                raise ValueError('Diurnal CSV line not the same length as header: ' + str(len(labels)))
-
-            # make sure the surrogate structure is ready
-            if region not in surrs:
-                surrs[region] = {}
-            if dow not in surrs[region]:
-                surrs[region][dow] = [dict((l, np.float32(0.0)) for l in labels) for _ in xrange(24)]
-
-            # load data into surrogate
-            for i, val in enumerate(values):
-                surrs[region][dow][hr][labels[i]] = val
+        labels, cols, values = FlexibleTemporalLoader._read_profile_file(file_path, 'Diurnal')
+        regions = [int(r) for r in cols[0]]
+        dows = cols[1]
+        hours = np.array([int(hr) for hr in cols[2]], dtype=np.int32)
+        bad_hours = (hours < 0) | (hours > 23)
+        if bad_hours.any():
+            raise ValueError('Hour in Diurnal CSV outside valid range 0 to 23: ' +
+                             cols[2][np.flatnonzero(bad_hours)[0]])
+
+        surrs = TemporalProfiles(sorted(set(regions)), sorted(set(dows)), labels)
+        surrs.set_values(regions, dows, hours, values)
 
-        f.close()
         return surrs
 
     @staticmethod
@@ -73,22 +63,30 @@ class FlexibleTemporalLoader(TemporalLoader):
             1,1,sun,0.79679,0.495819,0.324035,0.0
             1,2,mon,0.948027,0.91867,0.893196,0.0
         """
-        surrs = {}
+        labels, cols, values = FlexibleTemporalLoader._read_profile_file(file_path, 'DOW')
+        regions = [int(r) for r in cols[0]]
+        dows = cols[2]
+
+        surrs = TemporalProfiles(sorted(set(regions)), sorted(set(dows)), labels, hourly=False)
+        surrs.set_values(regions, dows, 0, values)
+
+        return surrs
+
+    @staticmethod
+    def _read_profile_file(file_path, name):
+        """ Read a temporal profile CSV file: three key columns, then one column per label.
+            Output: (labels, [key column lists], float32 array of values[line, label])
+        """
         f = open(file_path, 'r')
         labels = f.readline().rstrip().split(',')[3:]
-        for line in f.xreadlines():
-            # read line
-            ln = line.rstrip().split(',')
-            region = int(ln[0])
-            dow = ln[2]
-            values = [np.float32(val) for val in ln[3:]]
-            if len(values) != len(labels):
-                raise ValueError('DOW CSV line not the same length as header: ' + str(len(labels)))
-
-            # load data into surrogate
-            if region not in surrs:
-                surrs[region] = {}
-            surrs[region][dow] = dict((labels[i], val) for i, val in enumerate(values))
-
+        lines = [line.rstrip().split(',') for line in f.readlines() if line.strip()]
         f.close()
-        return surrs
+
+        for ln in lines:
+            if len(ln) != len(labels) + 3:
+                raise ValueError(name + ' CSV line not the same length as header: ' + str(len(labels)))
+
+        cols = [[ln[i] for ln in lines] for i in xrange(3)]
+        values = np.array([ln[3:] for ln in lines], dtype=np.float64).astype(np.float32)
+
+        return labels, cols, values.reshape((len(lines), len(labels)))
@@ -1,10 +1,15 @@
 
+from collections import deque
+from multiprocessing import Pool
 import numpy as np
 import os
+from compiled_surrogate_store import CompiledSurrogateStore
 from spatial_surrogate import SpatialSurrogate
 from src.core.spatial_loader import SpatialLoader
 from spatial_surrogate_data import SpatialSurrogateData
 
+# the loader being run in parallel, inherited by the worker processes when they are forked
+_LOADER = None
 
 class SmokeSpatialSurrogateLoader(SpatialLoader):
     ''' This class takes a simple list of EICs and a SMOKE v4 spatial surrogate file
@@ -28,6 +33,7 @@ class SmokeSpatialSurrogateLoader(SpatialLoader):
                               for g,d in self.region_info.iteritems())
 
         self.regions = self.config.parse_regions('Regions', 'regions')
+        self.surrogate_processes = int(self.config['Surrogates'].get('surrogate_processes', 1))
 
     def load(self, spatial_surrogates, temporal_surrogates):
         """ Overriding the abstract loader method to read an EPA SMOKE v4
@@ -39,11 +45,7 @@ class SmokeSpatialSurrogateLoader(SpatialLoader):
         spatial_surrogates.init_regions(self.regions)
 
         # loop through each SMOKE surrogate file, and related list of EICs
-        for i, surr_file_path in enumerate(self.smoke_surrogates):
-            # read SMOKE spatial surrogate
-            file_path = os.path.join(self.directory, surr_file_path)
-            region_surrogates = self._load_surrogate_file(file_path)
-
+        for i, region_surrogates in enumerate(self._load_surrogate_files()):
             # add the surrogate above for each label in the config file
             label = self.smoke_labels[i]
             for region, surrogate in region_surrogates.iteritems():
@@ -54,38 +56,138 @@ class SmokeSpatialSurrogateLoader(SpatialLoader):
 
         return spatial_surrogates, temporal_surrogates
 
+    def compile(self, file_path):
+        ''' Convert the SMOKE v4 spatial surrogates for the regions in this run into a single
+            compiled binary file, which can be read by the CompiledSpatialSurrogateLoader.
+        '''
+        grid = None
+        for surr_file_path in self.smoke_surrogates:
+            # all of the SMOKE surrogates must be on the same grid
+            smoke_path = os.path.join(self.directory, surr_file_path)
+            f = open(smoke_path, 'r')
+            header = f.readline().strip()
+            f.close()
+            if grid is None:
+                grid = header
+            elif header != grid:
+                raise ValueError('SMOKE surrogate file is on a different grid: ' + smoke_path)
+
+        surrogates = {}
+        for i, region_surrogates in enumerate(self._load_surrogate_files()):
+            # normalize the surrogates, exactly the same way as the text-based loader
+            label = self.smoke_labels[i]
+            surrogates[label] = {}
+            for region, surrogate in region_surrogates.iteritems():
+                surrogate = surrogate.surrogate()
+                if surrogate:
+                    surrogates[label][region] = (surrogate.rows, surrogate.cols, surrogate.fractions)
+
+        CompiledSurrogateStore.write(file_path, grid, surrogates)
+
+    def _load_surrogate_files(self):
+        ''' Generator: load each of the SMOKE v4 spatial surrogate files, in order.
+            With more than one surrogate process, the files are parsed in a pool of worker
+            processes. Only a limited number of files are in flight at once, to bound the
+            peak memory use.
+        '''
+        file_paths = [os.path.join(self.directory, f) for f in self.smoke_surrogates]
+        if self.surrogate_processes < 2 or len(file_paths) < 2:
+            for file_path in file_paths:
+                yield self._load_surrogate_file(file_path)
+            return
+
+        global _LOADER
+        _LOADER = self
+        processes = min(self.surrogate_processes, len(file_paths))
+        pool = Pool(processes)
+
+        in_flight = deque()
+        try:
+            for file_path in file_paths:
+                in_flight.append(pool.apply_async(_read_surrogate_arrays, (file_path,)))
+                if len(in_flight) > processes:
+                    yield self._build_surrogates(in_flight.popleft().get())
+
+            while in_flight:
+                yield self._build_surrogates(in_flight.popleft().get())
+        finally:
+            pool.close()
+            pool.join()
+            _LOADER = None
+
     def _load_surrogate_file(self, file_path):
         ''' Load a SMOKE v4 spatial surrogate text file.
             Use it to create an ESTA spatial surrogate.
-            GAI-based File format:
-            #GRID... header info
-            440;06030;237;45;0.00052883
-            440;06030;238;45;0.00443297
         '''
-        # create a dict of surrogates for each region in this file
+        return self._build_surrogates(self._read_surrogate_arrays(file_path))
+
+    def _build_surrogates(self, surrogate_arrays):
+        ''' create a spatial surrogate for each region, from the arrays read from a SMOKE file '''
         surrogates = {}
         for region in self.regions:
             surrogates[region] = SpatialSurrogate()
 
-        # process multi-region surrogate file
+        for region, (rows, cols, fractions) in surrogate_arrays.iteritems():
+            surrogates[region] = SpatialSurrogate(rows, cols, fractions)
+
+        return surrogates
+
+    def _read_surrogate_arrays(self, file_path):
+        ''' Read a SMOKE v4 spatial surrogate text file into NumPy arrays.
+            GAI-based File format:
+            #GRID... header info
+            440;06030;237;45;0.00052883
+            440;06030;238;45;0.00443297
+            Output: {region: (rows, cols, fractions)}, for each region in this run,
+                    with the grid cells in file order.
+        '''
         f = open(file_path, 'r')
         _ = f.readline()
-        for line in f.xreadlines():
-            ln = line.rstrip().split(';')
-            if len(ln) != 5:
-                continue
-
-            if len(ln[1]) == 12:
-                region = self.gai_codes[ln[1]]
-            else:
-                region = int(ln[1]) % 1000
-            if region not in self.regions:
-                continue
-
-            # re-written for speed
-            #cell = (int(ln[3]) - 1, int(ln[2]) - 1)  # (x, y)
-            #fraction = np.float32(ln[4])
-            surrogates[region][(int(ln[3]) - 1, int(ln[2]) - 1)] = np.float32(ln[4])
-
+        lines = f.read().splitlines()
         f.close()
+
+        # tokenize the whole file at once, skipping any line without all five columns
+        lines = [line for line in lines if line.count(';') == 4]
+        if not lines:
+            return {}
+        tokens = ';'.join(lines).split(';')
+
+        # map each unique GAI/FIPS code to a region
+        codes = tokens[1::5]
+        code_regions = dict((c, self.gai_codes[c] if len(c) == 12 else int(c) % 1000) for c in set(codes))
+        regions = np.array([code_regions[c] for c in codes], dtype=np.int32)
+        keep = np.in1d(regions, self.regions)
+        if not keep.any():
+            return {}
+
+        # cell = (y, x)
+        regions = regions[keep]
+        rows = self._parse_column(tokens[3::5], np.int32, file_path)[keep] - 1
+        cols = self._parse_column(tokens[2::5], np.int32, file_path)[keep] - 1
+        fractions = self._parse_column(tokens[4::5], np.float64, file_path)[keep].astype(np.float32)
+
+        # split the arrays by region, keeping the file order within each region
+        order = np.argsort(regions, kind='mergesort')
+        regions = regions[order]
+        starts = np.flatnonzero(np.r_[True, regions[1:] != regions[:-1]])
+        ends = np.r_[starts[1:], len(regions)]
+
+        surrogates = {}
+        for start, end in zip(starts, ends):
+            i = order[start:end]
+            surrogates[int(regions[start])] = (rows[i], cols[i], fractions[i])
+
         return surrogates
+
+    @staticmethod
+    def _parse_column(tokens, dtype, file_path):
+        ''' parse a list of numerical strings into a NumPy array '''
+        values = np.fromstring(' '.join(tokens), dtype=dtype, sep=' ')
+        if len(values) != len(tokens):
+            raise ValueError('Unable to parse the numerical columns in SMOKE surrogate file: ' + file_path)
+        return values
+
+
+def _read_surrogate_arrays(file_path):
+    ''' Worker process: parse a single SMOKE surrogate file into compact NumPy arrays by region '''
+    return _LOADER._read_surrogate_arrays(file_path)
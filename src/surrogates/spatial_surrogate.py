@@ -1,49 +1,122 @@
-
 import numpy as np
-from collections import defaultdict
 
 
-class SpatialSurrogate(defaultdict):
-    """ This is a sparse-matrix implementation of a spatial surrogate.
-        It will work in any number of dimensions, as long as the coordinates are given as a tuple.
-        You must first fill this object with data, then use the `.surrogate()` method to return a
-        new version of the object where all the values sum to 1.0.
+class SpatialSurrogate(object):
+    """ This is a sparse-matrix implementation of a 2D spatial surrogate.
+        The grid cells are stored as parallel arrays of (int32) rows and columns, and (float32)
+        fractions, sorted by cell. A dict-like view is kept for older callers:
+            surrogate[(row, col)] = fraction
+        You must first fill this object with data, then use the `.surrogate()` method to
+        normalize it so all the values sum to 1.0.
     """
 
-    def __init__(self):
-        defaultdict.__init__(self, np.float32)
+    __slots__ = ('rows', 'cols', 'fractions')
+
+    def __init__(self, rows=None, cols=None, fractions=None):
+        rows = np.asarray([] if rows is None else rows, dtype=np.int32)
+        cols = np.asarray([] if cols is None else cols, dtype=np.int32)
+        fractions = np.asarray([] if fractions is None else fractions, dtype=np.float32)
+        if not (len(rows) == len(cols) == len(fractions)):
+            raise ValueError('The spatial surrogate rows, columns, and fractions must be the same length.')
+
+        # sort by cell, and (like a dict) only keep the last fraction given for each cell
+        keys = self._keys(rows, cols)
+        if len(keys) and not (keys[1:] > keys[:-1]).all():
+            last = len(keys) - 1 - np.unique(keys[::-1], return_index=True)[1]
+            rows, cols, fractions = rows[last], cols[last], fractions[last]
 
-    def __getitem__(self, key):
-        """ Setter method for spatial surrogate dictionary """
-        val = defaultdict.__getitem__(self, key)
-        return val
+        self.rows = rows
+        self.cols = cols
+        self.fractions = fractions
 
-    def __setitem__(self, key, val):
-        """ Getter method for spatial surrogate dictionary """
-        if type(key) != tuple:
-            raise TypeError('The coordinate was not a tuple: ' + str(key))
-        defaultdict.__setitem__(self, key, val)
+    @staticmethod
+    def _keys(rows, cols):
+        """ a single sortable integer key for each (row, col) cell """
+        return (rows.astype(np.int64) << 32) + cols
 
     def surrogate(self):
-        """ A simple helper method to return a version of this object
-            where all the values sum to 1.0.
+        """ A simple helper method to normalize this surrogate, so all the values sum to 1.0.
+            If all the values are zero, the surrogate is spread evenly over its cells.
         """
-        total = np.sum(defaultdict.values(self))
+        total = np.float32(self.fractions.sum(dtype=np.float64))
 
         if total == 1.0:
             return self
         elif total:
             # The easy situation: just normalize all the values so they sum to 1.0
-            for key, value in self.iteritems():
-                self.__setitem__(key, value / total)
-        else:
+            self.fractions = self.fractions / total
+        elif len(self.fractions):
             # What if the total is zero?
-            number_keys = defaultdict.__len__(self)
-            if number_keys:
-                return defaultdict(lambda: np.float32(1.0 / number_keys))
+            self.fractions = np.full(len(self.fractions), 1.0 / len(self.fractions), dtype=np.float32)
 
         return self
 
-    def __repr__(self):
-        return self.__class__.__name__ + '(' + str(dict(self))[1: -1] + ')'
+    def bbox(self):
+        """ The inclusive bounding box of all the grid cells: (min_row, max_row, min_col, max_col) """
+        if not len(self.rows):
+            return None
+        return self.rows.min(), self.rows.max(), self.cols.min(), self.cols.max()
 
+    def to_raster(self, min_row, max_row, min_col, max_col):
+        """ Build a dense raster of this surrogate, for an inclusive bounding box.
+            NOTE: The bounding box must contain every grid cell in the surrogate.
+        """
+        raster = np.zeros((max_row - min_row + 1, max_col - min_col + 1), dtype=np.float32)
+        raster[self.rows - min_row, self.cols - min_col] = self.fractions
+        return raster
+
+    # dict-like view, by (row, col) cell
+
+    def _find(self, cell):
+        """ find the index of a grid cell, or None if it is not in the surrogate """
+        if type(cell) != tuple:
+            raise TypeError('The coordinate was not a tuple: ' + str(cell))
+        keys = self._keys(self.rows, self.cols)
+        key = (int(cell[0]) << 32) + int(cell[1])
+        i = np.searchsorted(keys, key)
+        if i < len(keys) and keys[i] == key:
+            return i
+        return None
+
+    def __getitem__(self, cell):
+        """ Getter method for spatial surrogate (missing cells have a fraction of zero) """
+        i = self._find(cell)
+        if i is None:
+            return np.float32(0.0)
+        return self.fractions[i]
+
+    def __setitem__(self, cell, val):
+        """ Setter method for spatial surrogate
+            NOTE: This copies all the arrays, so it should not be used to fill a large surrogate.
+        """
+        i = self._find(cell)
+        if i is not None:
+            self.fractions = self.fractions.copy()
+            self.fractions[i] = val
+        else:
+            self.__init__(np.append(self.rows, cell[0]), np.append(self.cols, cell[1]),
+                          np.append(self.fractions, val))
+
+    def __contains__(self, cell):
+        return self._find(cell) is not None
+
+    def __len__(self):
+        return len(self.fractions)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def keys(self):
+        return zip(self.rows.tolist(), self.cols.tolist())
+
+    def values(self):
+        return list(self.fractions)
+
+    def iteritems(self):
+        return iter(self.items())
+
+    def items(self):
+        return zip(self.keys(), self.fractions)
+
+    def __repr__(self):
+        return self.__class__.__name__ + '(' + str(dict(self.iteritems()))[1: -1] + ')'
@@ -1,4 +1,7 @@
 
+import numpy as np
+
+
 class SpatialSurrogateData(object):
     """ This class is designed as a helper to make organizing the huge amount of spatial
         information we pull out of the spatial surrogate files easier.
@@ -8,6 +11,7 @@ class SpatialSurrogateData(object):
 
     def __init__(self):
         self.data = {}
+        self.rasters = {}
 
     def init_regions(self, regions):
         """ Helper post-init method, to flush out the dictionary some """
@@ -52,3 +56,26 @@ class SpatialSurrogateData(object):
         for region in self.data:
             for label in self.data[region]:
                 self.data[region][label] = self.data[region][label].surrogate()
+
+    def build_rasters(self, region_boxes):
+        """ Build a dense raster of every normalized surrogate, sized to its region's bounding box.
+            The rasters are cached by (region, label), as they do not change during a run.
+            Bounding boxes are inclusive: {'lat': (51, 92), 'lon': (156, 207)}
+        """
+        self.rasters = {}
+        for region in self.data:
+            box = region_boxes[region]
+            min_row, max_row = box['lat']
+            min_col, max_col = box['lon']
+
+            for label, surrogate in self.data[region].iteritems():
+                # validate the bounding box once, here, instead of while gridding
+                rows, cols = surrogate.rows, surrogate.cols
+                outside = (rows < min_row) | (rows > max_row) | (cols < min_col) | (cols > max_col)
+                if outside.any():
+                    i = np.flatnonzero(outside)[0]
+                    err = ('Spatial Surrogate grid cell (%d, %d) found outside of bounding box' + \
+                           ' %s in region %d.') % (rows[i], cols[i], box, region)
+                    raise KeyError(err)
+
+                self.rasters[(region, label)] = surrogate.to_raster(min_row, max_row, min_col, max_col)
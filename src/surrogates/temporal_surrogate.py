@@ -1,5 +1,6 @@
 
 from array import array
+import numpy as np
 
 
 class TemporalSurrogate(array):
@@ -23,3 +24,200 @@ class TemporalSurrogate(array):
 
     def __repr__(self):
         return array.__repr__(self).replace('array', self.__class__.__name__, 1)
+
+
+class TemporalProfiles(object):
+    """ A set of temporal profiles, stored in a single float32 array:
+            data[region, dow, hour, label] = factor
+        with integer indices for the region, day-of-week, and label. Day-of-week profiles
+        have only a single "hour".
+        A dict-like view is kept for older callers:
+            diurnal[region][dow][hr][label] = factor
+            dow[region][dow][label] = factor
+    """
+
+    def __init__(self, regions, dows, labels, hourly=True):
+        self.regions = list(regions)
+        self.dows = list(dows)
+        self.labels = list(labels)
+        self.hourly = hourly
+        self.region_index = dict((r, i) for i, r in enumerate(self.regions))
+        self.dow_index = dict((d, i) for i, d in enumerate(self.dows))
+        self.label_index = dict((l, i) for i, l in enumerate(self.labels))
+        self.data = np.zeros((len(self.regions), len(self.dows), 24 if hourly else 1, len(self.labels)),
+                             dtype=np.float32)
+        self.present = np.zeros((len(self.regions), len(self.dows)), dtype=bool)
+
+    def set_values(self, regions, dows, hours, values):
+        """ Bulk setter method: one row of label values for each (region, dow, hour) given.
+            If a row is given more than once, the last one is kept.
+        """
+        r = np.array([self.region_index[region] for region in regions], dtype=np.int32)
+        d = np.array([self.dow_index[dow] for dow in dows], dtype=np.int32)
+        self.data[r, d, hours] = values
+        self.present[r, d] = True
+
+    def has(self, region, dow):
+        """ Are there profiles for this region and day-of-week? """
+        r = self.region_index.get(region)
+        d = self.dow_index.get(dow)
+        return r is not None and d is not None and bool(self.present[r, d])
+
+    def day(self, region, dow, labels=None):
+        """ Get the (label, hour) matrix of factors for a region and day-of-week, in one call.
+            Optionally, pick the labels (in order, repeats allowed).
+        """
+        if not self.has(region, dow):
+            raise KeyError('No temporal profiles found for region %s on %s.' % (str(region), dow))
+
+        day = self.data[self.region_index[region], self.dow_index[dow]].T
+        if labels is None:
+            return day
+        return day[np.array([self.label_index[label] for label in labels], dtype=np.int32)]
+
+    # dict-like view, by region
+
+    def __getitem__(self, region):
+        if region not in self.region_index:
+            raise KeyError(region)
+        return TemporalProfilesView(self, (self.region_index[region], ))
+
+    def __contains__(self, region):
+        return region in self.region_index
+
+    def __len__(self):
+        return len(self.regions)
+
+    def __iter__(self):
+        return iter(self.regions)
+
+    def get(self, region, default=None):
+        if region not in self.region_index:
+            return default
+        return self.__getitem__(region)
+
+    def keys(self):
+        return list(self.regions)
+
+    def iteritems(self):
+        for region in self.regions:
+            yield region, self.__getitem__(region)
+
+    def items(self):
+        return list(self.iteritems())
+
+
+class TemporalProfilesView(object):
+    """ A dict-like (or, for hours, list-like) view of one level of a TemporalProfiles object:
+            region --> dow --> hour (diurnal only) --> label
+    """
+
+    __slots__ = ('_profiles', '_index')
+
+    def __init__(self, profiles, index):
+        self._profiles = profiles
+        self._index = index
+
+    def _is_hours(self):
+        return self._profiles.hourly and len(self._index) == 2
+
+    def _keys(self):
+        level = len(self._index)
+        if level == 1:
+            present = self._profiles.present[self._index[0]]
+            return [dow for d, dow in enumerate(self._profiles.dows) if present[d]]
+        elif self._is_hours():
+            return range(24)
+        return list(self._profiles.labels)
+
+    def __getitem__(self, key):
+        level = len(self._index)
+        if level == 1:
+            d = self._profiles.dow_index.get(key)
+            if d is None or not self._profiles.present[self._index[0], d]:
+                raise KeyError(key)
+            index = self._index + (d, )
+            if not self._profiles.hourly:
+                index += (0, )
+            return TemporalProfilesView(self._profiles, index)
+        elif self._is_hours():
+            if key < 0 or key > 23:
+                raise IndexError('Hour outside valid range 0 to 23: ' + str(key))
+            return TemporalProfilesView(self._profiles, self._index + (key, ))
+
+        return self._profiles.data[self._index + (self._profiles.label_index[key], )]
+
+    def __contains__(self, key):
+        return key in self._keys()
+
+    def __len__(self):
+        return len(self._keys())
+
+    def __iter__(self):
+        if self._is_hours():
+            # like a list, iterate over the hourly values
+            return (self.__getitem__(hr) for hr in xrange(24))
+        return iter(self._keys())
+
+    def get(self, key, default=None):
+        try:
+            return self.__getitem__(key)
+        except KeyError:
+            return default
+
+    def keys(self):
+        return self._keys()
+
+    def values(self):
+        return [self.__getitem__(key) for key in self._keys()]
+
+    def iteritems(self):
+        for key in self._keys():
+            yield key, self.__getitem__(key)
+
+    def items(self):
+        return list(self.iteritems())
+
+    def __repr__(self):
+        return self.__class__.__name__ + '(' + str(self.items()) + ')'
+
+
+class DailyTemporalFactors(object):
+    """ The day-of-week and diurnal temporal surrogates, multiplied together into a single
+        float32 array of hourly factors:
+            data[region, dow, temporal key, hour] = DOW factor * diurnal factor
+        This lets an entire day of emissions be temporally scaled with one multiplication.
+    """
+
+    def __init__(self, dow_surrs, diurnal_surrs):
+        self.regions = dict((r, i) for i, r in enumerate(sorted(diurnal_surrs.regions)))
+        self.dows = dict((d, i) for i, d in enumerate(sorted(diurnal_surrs.dows)))
+        self.keys = dict((k, i) for i, k in enumerate(sorted(diurnal_surrs.labels)))
+        self.data = np.zeros((len(self.regions), len(self.dows), len(self.keys), 24), dtype=np.float32)
+        self.valid = set()
+
+        # the DOW factor of each diurnal label (zero if the DOW profiles don't have that label)
+        keys = sorted(self.keys)
+        dow_labels = np.array([dow_surrs.label_index.get(key, -1) for key in keys], dtype=np.int32)
+
+        for region, r in self.regions.iteritems():
+            for dow, d in self.dows.iteritems():
+                if not diurnal_surrs.has(region, dow) or not dow_surrs.has(region, dow):
+                    continue
+                dow_factors = dow_surrs.day(region, dow)[:, 0]
+                dow_factors = np.where(dow_labels >= 0, dow_factors[dow_labels], np.float32(0.0))
+                self.data[r, d] = dow_factors[:, np.newaxis] * diurnal_surrs.day(region, dow, keys)
+                self.valid.add((region, dow))
+
+    def factors(self, region, dow):
+        """ Get the (temporal key, hour) array of factors for a region and day-of-week. """
+        if (region, dow) not in self.valid:
+            raise KeyError('No temporal profiles found for region %s on %s.' % (str(region), dow))
+
+        return self.data[self.regions[region], self.dows[dow]]
+
+    def eic_factors(self, region, dow, eic_keys):
+        """ Get the (EIC, hour) array of factors for a region and day-of-week,
+            given the temporal key of each EIC.
+        """
+        return self.factors(region, dow)[np.array([self.keys[key] for key in eic_keys], dtype=np.int32)]
@@ -76,11 +76,9 @@ class EmfacNcfTotalsTester(OutputTester):
             if region not in emfac_emis.data:
                 continue
             region_data = emfac_emis.get(region, date)
-            for eic_data in region_data.itervalues():
-                for poll, value in eic_data.iteritems():
-                    #print poll, value  #MMD
-                    if poll.upper() in emfac_totals:
-                        emfac_totals[poll.upper()] += value
+            for poll, value in region_data.totals().iteritems():
+                if poll.upper() in emfac_totals:
+                    emfac_totals[poll.upper()] += value
 
         # find diff between EMFAC and NetCDF & add to file
         for poll in self.PRINT_POLLS:
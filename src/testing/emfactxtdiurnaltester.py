@@ -92,7 +92,7 @@ class EmfacTxtDiurnalTester(OutputTester):
         """ Read the diurnal profiles file, and parse it into a collection, based on the
             day-of-week and region for each EIC.
 
-            The original profiles will be in a dictionary with the form:
+            The original profiles will be in a TemporalProfiles object, with the form:
             profs[region][dow][hr] = {'LD': 1.0, 'LM': 0.5, 'HH': 0.0, ...}
 
             The new output profiles will be arranged like:
@@ -104,15 +104,14 @@ class EmfacTxtDiurnalTester(OutputTester):
         orig_profs = ctl.load_diurnal(ctl.diurnal_path)
 
         # reorganize the data into something more useful for our individual EICs
+        eics = list(self.eic_info)
+        labels = [self.eic_info[eic][0] for eic in eics]
         profs = {}
         for dow in set(DOW.values()):
             profs[dow] = {}
             for region in self.regions:
-                profs[dow][region] = {}
-                for eic in self.eic_info:
-                    profs[dow][region][eic] = np.zeros(24, dtype=np.float32)
-                    for hr in xrange(24):
-                        profs[dow][region][eic][hr] = orig_profs[region][dow][hr][self.eic_info[eic][0]]
+                day = orig_profs.day(region, dow, labels)
+                profs[dow][region] = dict((eic, day[i]) for i, eic in enumerate(eics))
 
         return profs
 
@@ -7,7 +7,6 @@ import os
 from src.core.date_utils import DOW, find_holidays
 from src.core.eic_utils import eic_reduce, MAX_EIC_PRECISION
 from src.core.output_tester import OutputTester
-from src.emissions.emissions_table import EmissionsTable
 from src.surrogates.flexibletemporalloader import FlexibleTemporalLoader
 
 
@@ -111,16 +110,14 @@ class EmfacTxtTotalsTester(OutputTester):
         elif self.config['Output']['eic_precision'] == MAX_EIC_PRECISION:
             return
 
+        # dates that share an emissions table will also share the reduced table
+        reduced = {}
         for region in emis.data:
             for date in emis.data[region]:
-                e = EmissionsTable()
-                for eic in emis.data[region][date]:
-                    new_eic = self.eic_reduce(eic)
-                    if new_eic not in e:
-                        e[new_eic] = defaultdict(np.float32)
-                    for poll, value in emis.data[region][date][eic].iteritems():
-                        e[new_eic][poll] += value
-                emis.data[region][date] = e
+                table = emis.data[region][date]
+                if id(table) not in reduced:
+                    reduced[id(table)] = (table, table.reduce_eics(self.eic_reduce))
+                emis.data[region][date] = reduced[id(table)][1]
 
     def _read_and_compare_txt(self, pmeds, cse, date, emis, dow):
         ''' Read the output PMEDS files and compare the results with the